@@ -0,0 +1,2 @@
+from .fs import iter_files, list_files, cached_files, fast_copy, copy_file, copy_files
+from .dt import remove_minute_from_datetime
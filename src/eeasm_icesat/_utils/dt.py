@@ -0,0 +1,19 @@
+'''Author: Andrew Martin
+Creation date: 14/10/26
+
+Datetime functions shared by the sub-packages.
+'''
+
+def remove_minute_from_datetime(dtObj):
+    '''Function to remove the minute (and finer) component(s) from a datetime object.
+    
+    INPUTS:
+        dtObj : datetime.datetime object
+            The datetime object for which we want to remove the minute component (round down).
+            
+    OUTPUTS:
+        dtObj_ : datetime.datetime object
+            The datetime object with the minute and finer components removed.
+    '''
+    dtObj_ = dtObj.replace(minute=0, second=0, microsecond=0)
+    return dtObj_
@@ -0,0 +1,155 @@
+'''Author: Andrew Martin
+Creation date: 14/10/26
+
+Functions shared by the sub-packages to list the data files in a directory.
+'''
+
+import os
+import errno
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+def iter_files(root, suffix=''):
+    '''Function to iterate over the names of the files in the directory root that end with suffix, in a single os.scandir pass.
+
+    INPUTS:
+        root : string
+            path to the directory to be listed.
+
+        suffix : string
+            the ending that the file names must have. The default '' matches every file.
+
+    OUTPUTS:
+        names : generator
+            generator of the file names (not the full paths) in root.
+    '''
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(suffix):
+                yield entry.name
+
+
+def list_files(root, suffix='', sort=True):
+    '''Function to return a list of the names of the files in root that end with suffix. See iter_files.
+
+    INPUTS:
+        root, suffix : see iter_files
+
+        sort : bool
+            If True, the names are sorted.
+
+    OUTPUTS:
+        names : list
+            list of the file names in root.
+    '''
+    if sort:
+        return sorted(iter_files(root, suffix))
+    return list(iter_files(root, suffix))
+
+
+def cached_files(root, index=None):
+    '''Function to return the set of the names of the files in the directory root, reusing the listing in index if root has already been scanned.
+
+    INPUTS:
+        root : string
+            path to the directory to be listed.
+
+        index : None, dict
+            dictionary of {directory: set of file names}, shared between functions so that each directory is only scanned once. The returned set is the one stored in index, so functions writing files into root should add their names to it. If None, root is scanned.
+
+    OUTPUTS:
+        names : set
+            set of the file names (not the full paths) in root.
+    '''
+    if index is None:
+        return set(iter_files(root))
+    key = os.path.abspath(root)
+    if key not in index:
+        index[key] = set(iter_files(root))
+    return index[key]
+
+
+# errors from os.copy_file_range meaning it can't be used between the two files, rather than that the copy has failed
+_COPY_FILE_RANGE_UNSUPPORTED = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF)
+
+def fast_copy(src, dst):
+    '''Function to copy the contents and permission bits of the file src to dst, using os.copy_file_range where possible.
+
+    os.copy_file_range copies the data in the kernel, and allows network filesystems that support it (i.e. NFS 4.2, Lustre) to copy the file on the server. If it isn't available for the os or filesystems, shutil.copy is used instead, and if it stops copying before the end of src, the rest of the file is copied with shutil.copyfileobj.
+
+    INPUTS:
+        src : string
+            The full filename of the file to be copied.
+
+        dst : string
+            The full filename of the copy.
+    '''
+    if hasattr(os, 'copy_file_range'):
+        try:
+            # the files are opened unbuffered, so that the file positions advanced by os.copy_file_range are used by the fallback copy
+            with open(src, 'rb', buffering=0) as fsrc, open(dst, 'wb', buffering=0) as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        # some filesystems (e.g. NFS across devices) return 0 rather than raising, so the rest of the file is copied in userspace
+                        shutil.copyfileobj(fsrc, fdst, 4<<20)
+                        break
+                    remaining -= copied
+            shutil.copymode(src, dst)
+            return
+        except OSError as err:
+            if err.errno not in _COPY_FILE_RANGE_UNSUPPORTED:
+                raise
+    shutil.copy(src, dst)
+
+
+def copy_file(src, dst, link_if_possible=False):
+    '''Function to copy the file src to dst, hard linking it if possible.
+
+    Linking fails if src and dst are on different filesystems, in which case the file is copied with fast_copy.
+
+    INPUTS:
+        src : string
+            The full filename of the file to be copied.
+
+        dst : string
+            The full filename of the copy.
+
+        link_if_possible : boolean
+            if True, try to hard link dst to src before copying.
+    '''
+    if os.path.exists(dst) and os.path.samefile(src, dst): # already linked
+        return
+    if link_if_possible:
+        try:
+            os.link(src, dst)
+            return
+        except OSError: # dst already exists, or src and dst are on different filesystems
+            pass
+    fast_copy(src, dst)
+
+
+def copy_files(paths, n_threads=16, link_if_possible=False):
+    '''Function to copy multiple files with a pool of threads, see copy_file.
+
+    On networked filesystems each copy is dominated by the round-trip latency, so the copies are overlapped in threads rather than run one after another.
+
+    INPUTS:
+        paths : iterable
+            Iterable of (src, dst) tuples of the full filenames of the files to be copied and their copies.
+
+        n_threads : int
+            The number of threads copying files at once. 1 copies the files sequentially in the current thread.
+
+        link_if_possible : boolean
+            see copy_file
+    '''
+    if n_threads == 1:
+        for src, dst in paths:
+            copy_file(src, dst, link_if_possible)
+        return
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        futures = [executor.submit(copy_file, src, dst, link_if_possible) for src, dst in paths]
+        for future in futures:
+            future.result() # re-raise any error from the copies
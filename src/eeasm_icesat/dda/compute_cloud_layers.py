@@ -8,6 +8,8 @@ The function takes heavy inspiration from Adam Hayes' function compute_cloud_lay
 import numpy as np
 import xarray as xr
 
+from .steps.get_layer_boundaries import _height_order
+
 
 def compute_cloud_layers(ds, coord_height='height', coord_x='time', sel_args={}, numLayers=10, min_depth=90, min_sep=90, ground_clearance=50):
     '''Function for computing the cloud layer properties from output of the DDA-atmos algorithm
@@ -48,10 +50,11 @@ def compute_cloud_layers(ds, coord_height='height', coord_x='time', sel_args={},
 
     # if the height coordinate isn't in ascending order, need to make sure to flip it
     flipped = False
-    if (np.diff(ycoor)<=0).any():
-        if (np.diff(ycoor)>0).any(): # raise error if not ordered
-            msg = 'ycoor isnt ordered'
-            raise ValueError(msg)
+    order = _height_order(np.asarray(ycoor))
+    if order == 0: # raise error if not ordered
+        msg = 'ycoor isnt ordered'
+        raise ValueError(msg)
+    if order == -1:
         flipped = True
         ycoor = np.flip(ycoor)
 
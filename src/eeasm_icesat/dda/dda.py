@@ -9,10 +9,16 @@ From there, a second run to get lower density cloud regions can be performed, or
 I'm aiming to write the script in such a way that functions can be modularly selected so that different versions of the DDA algorithm can be implemented in the single script.
 '''
 
+import os
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import xarray as xr
-from scipy import signal
-from skimage.morphology import remove_small_objects
+import numba
+from scipy import signal, ndimage
+
+from .steps.calc_threshold import _nan_quantile
 
 
 def kernal_Gaussian(sigma_y, sigma_x=None, a_m=None,
@@ -64,16 +70,49 @@ def kernal_Gaussian(sigma_y, sigma_x=None, a_m=None,
         n = 2 * np.round(sigma_y/dy * cutoff) + 1
         m = 2 * np.round(sigma_x/dx * cutoff) + 1
 
-    x = np.arange(-m//2, m//2+1)*dx
-    y = np.arange(-n//2, n//2+1)*dy
-    X,Y = np.meshgrid(x,y)
-    
-    gaussian = lambda x,y,sx,sy: np.exp(-0.5 * (np.power(x/sx, 2) + np.power(y/sy, 2)))
-    kernal = gaussian(X,Y,sigma_x,sigma_y)
-    return kernal / np.sum(kernal) # return the normalised version of the kernal
+    # the brackets matter: -m//2 rounds down, which would give an off-centre kernal with an extra column for odd m
+    x = np.arange(-(m//2), m//2+1)*dx
+    y = np.arange(-(n//2), n//2+1)*dy
+
+    # the Gaussian is separable, so it is the outer product of the 1-dimensional Gaussians in each direction
+    gx = np.exp(-0.5 * (x/sigma_x)**2)
+    gy = np.exp(-0.5 * (y/sigma_y)**2)
+    kernal = np.multiply.outer(gy, gx)
+    kernal /= kernal.sum() # return the normalised version of the kernal
+    return kernal
+
+
+# cache of kernals that have already been computed, keyed on the kernal arguments, so that repeated calls on the same resolution don't recompute them.
+_KERNAL_CACHE = {}
+
+
+def _get_kernal(kernal_args):
+    '''Function to return the kernal for the given kernal arguments, using a previously computed kernal if one exists.
+
+    The cached kernals are set to read-only, as they are shared between calls.
+
+    INPUTS:
+        kernal_args : dict
+            Dictionary containing the arguments for the kernal computation, including the 'kernalfunc' key.
+
+    OUTPUTS:
+        kernal : np.ndarray
+            2-dimensional numpy array for the kernal.
+    '''
+    try:
+        key = tuple(sorted(kernal_args.items()))
+        hash(key)
+    except TypeError: # unhashable arguments can't be cached, so compute the kernal directly
+        return kernal_args['kernalfunc'](**kernal_args)
+
+    if key not in _KERNAL_CACHE:
+        kernal = kernal_args['kernalfunc'](**kernal_args)
+        kernal.setflags(write=False)
+        _KERNAL_CACHE[key] = kernal
+    return _KERNAL_CACHE[key]
 
 
-def convolve_masked(data, mask, kernal, **kwargs):
+def convolve_masked(data, mask, kernal, backend='cpu', **kwargs):
     '''Function to perform a convolution of a kernal on masked data.
     
     The convention is that masked values are 1s in mask, and the data to convolve is 0s in the mask.
@@ -91,6 +130,9 @@ def convolve_masked(data, mask, kernal, **kwargs):
         kernal : np.ndarray
             convolutional kernal
 
+        backend : string
+            'cpu' (default) to use scipy.signal.convolve2d, or 'cupy' to perform the convolutions on the GPU with cupyx.scipy.signal.convolve2d (requires cupy).
+
         kwargs : other arguments to be passed to np.convolve
 
     OUTPUTS:
@@ -101,16 +143,186 @@ def convolve_masked(data, mask, kernal, **kwargs):
         if arg in kwargs:
             convargs[arg] = kwargs[arg]
 
-    norm = signal.convolve2d(~mask, kernal, **convargs)
+    norm = _convolve2d(~mask, kernal, backend, **convargs)
     masked_data = data.copy()
     masked_data[mask] = 0
-    density = signal.convolve2d(masked_data,kernal, **convargs)
+    density = _convolve2d(masked_data,kernal, backend, **convargs)
+
+    # normalise density field
+    np.divide(density, norm, out=density, where=norm>0)
+    return density, norm
+
+
+def _convolve2d(arr, kernal, backend='cpu', **convargs):
+    '''Function to perform a 2-dimensional convolution with the requested backend, returning a numpy array.
+
+    For backend='cupy', the arrays are copied to the GPU, convolved with cupyx.scipy.signal.convolve2d, and the result copied back.
+    '''
+    if backend == 'cpu':
+        return signal.convolve2d(arr, kernal, **convargs)
+    if backend == 'cupy':
+        try:
+            import cupy as cp
+            from cupyx.scipy import signal as cp_signal
+        except ImportError:
+            print('dda._convolve2d: cupy is required for backend="cupy"')
+            raise
+        return cp_signal.convolve2d(cp.asarray(arr), cp.asarray(kernal), **convargs).get()
+    msg = f'dda._convolve2d: unknown backend {backend}'
+    raise ValueError(msg)
+
+
+def _masked_inputs(data, mask, extra_mask=None):
+    '''Function to compute the valid-pixel mask and the zero-filled data for a masked convolution.
+
+    The data keeps its precision (float32 or float64, with other dtypes promoted to at least float32), so that the fused and gaussian_filter paths match convolve_masked for the same input.
+
+    Pixels are valid where neither mask nor extra_mask are set. The combined mask is computed directly into the valid buffer, so no intermediate mask arrays are created.
+
+    INPUTS:
+        data : np.ndarray
+            array containing the data to be convolved
+
+        mask : np.ndarray (dtype=boolean)
+            array of the same shape as data with 1s where the data is masked
+
+        extra_mask : np.ndarray (dtype=boolean), None
+            optional additional mask of the same shape as data
+
+    OUTPUTS:
+        valid : np.ndarray (dtype=boolean)
+            array with 1s where the data is unmasked
+
+        masked_data : np.ndarray (dtype=np.result_type(data.dtype, np.float32))
+            copy of data with masked values set to 0
+    '''
+    if extra_mask is None:
+        valid = np.logical_not(mask)
+    else:
+        valid = np.logical_or(mask, extra_mask)
+        np.logical_not(valid, out=valid)
+    # copy only the valid values, so that nans in the masked region don't propagate
+    masked_data = np.zeros(data.shape, dtype=np.result_type(data.dtype, np.float32))
+    np.copyto(masked_data, data, casting='same_kind', where=valid)
+    return valid, masked_data
+
+
+def convolve_masked_fused(data, mask, extra_mask, kernal, backend='cpu', **kwargs):
+    '''Function to perform a convolution of a kernal on data masked by the union of two masks.
+
+    This is equivalent to convolve_masked(data, np.logical_or(mask, extra_mask), kernal), but the combined mask, its inverse and the masked copy of the data are produced in two passes over the arrays.
+
+    !!!! The normalised density field is returned !!!!
+
+    INPUTS:
+        data : np.ndarray
+            array containing the data for which we want to perform the masked convolution on
+
+        mask, extra_mask : np.ndarray (dtype=boolean)
+            arrays of the same shape as data that contain 1s where nans and masked values are, and 0s where the desired data exists.
+
+        kernal : np.ndarray
+            convolutional kernal
+
+        backend : string
+            'cpu' or 'cupy', see convolve_masked.
+
+        kwargs : other arguments to be passed to signal.convolve2d
+
+    OUTPUTS:
+        density : np.ndarray
+            the normalised density field
+
+        norm : np.ndarray
+            the convolution of the kernal with the unmasked pixels, used to normalise the density field
+    '''
+    convargs = {'mode':'same', 'boundary':'symm'} # default convargs
+    for arg in ['mode','boundary','fillvalue']:
+        if arg in kwargs:
+            convargs[arg] = kwargs[arg]
+
+    valid, masked_data = _masked_inputs(data, mask, extra_mask)
+    norm = _convolve2d(valid, kernal, backend, **convargs)
+    density = _convolve2d(masked_data, kernal, backend, **convargs)
 
     # normalise density field
-    density[norm>0] = density[norm>0] / norm[norm>0]
+    np.divide(density, norm, out=density, where=norm>0)
     return density, norm
 
 
+def convolve_masked_gauss(data, mask, sigma_y, sigma_x=None, a_m=None, dy=1, dx=1, cutoff=4, extra_mask=None, **kwargs):
+    '''Function to perform the masked convolution of a Gaussian kernal on masked data, using scipy.ndimage.gaussian_filter.
+
+    This is equivalent to convolve_masked with a kernal from kernal_Gaussian, but the kernal is never constructed: gaussian_filter applies two separable 1-dimensional passes in C, which is considerably cheaper than the 2-dimensional convolution.
+
+    !!!! The normalised density field is returned !!!!
+
+    INPUTS:
+        data : np.ndarray
+            array containing the data for which we want to perform the masked convolution on
+
+        mask : np.ndarray (dtype=boolean)
+            array of the same shape as data that contains 1s where nans and masked values are, and 0s where the desired data exists.
+
+        sigma_y, sigma_x, a_m, dy, dx : see kernal_Gaussian
+
+        cutoff : float
+            Number of standard deviations in both directions to cut the kernal off at.
+
+        extra_mask : np.ndarray (dtype=boolean)
+            Optional additional mask, combined with mask without materialising the combined array (see convolve_masked_fused).
+
+        kwargs : any additional arguments. These won't be used however.
+
+    OUTPUTS:
+        density : np.ndarray
+            the normalised density field
+
+        norm : np.ndarray
+            the convolution of the kernal with the unmasked pixels, used to normalise the density field
+    '''
+    if sigma_x is None:
+        if a_m is None:
+            print('dda.convolve_masked_gauss: a_m and sigma_x undefined')
+            raise ValueError
+        sigma_x = sigma_y * a_m
+    sigma = (sigma_y/dy, sigma_x/dx)
+    # the kernal half-widths are rounded as in kernal_Gaussian, rather than with gaussian_filter's own rounding of truncate*sigma
+    radius = tuple(int(np.round(s*cutoff)) for s in sigma)
+
+    valid, masked_data = _masked_inputs(data, mask, extra_mask)
+
+    # mode='reflect' matches the boundary='symm' default used in convolve_masked
+    norm = ndimage.gaussian_filter(valid, sigma=sigma, radius=radius, mode='reflect', output=masked_data.dtype)
+    density = ndimage.gaussian_filter(masked_data, sigma=sigma, radius=radius, mode='reflect', output=masked_data)
+
+    # normalise density field
+    np.divide(density, norm, out=density, where=norm>0)
+    return density, norm
+
+
+def _use_gauss_filter(kernal_args, density_args):
+    '''Function to determine if the density field can be computed with convolve_masked_gauss rather than convolve_masked.
+
+    This is the case when the default Gaussian kernal is used with a cutoff on the cpu backend, with the default mode='same' and boundary='symm' convolution arguments (given explicitly or not). fillvalue is only used with boundary='fill', so it doesn't affect the choice.
+    '''
+    return (kernal_args.get('kernalfunc') is kernal_Gaussian
+            and kernal_args.get('cutoff') is not None
+            and density_args.get('backend', 'cpu') == 'cpu'
+            and density_args.get('mode', 'same') == 'same'
+            and density_args.get('boundary', 'symm') == 'symm')
+
+
+def _calc_density(in_data, mask, kernal_args, density_args, extra_mask=None):
+    '''Function to calculate the density field, selecting the gaussian_filter path where possible. If given, extra_mask is combined with mask in the fused masked convolutions.'''
+    if _use_gauss_filter(kernal_args, density_args):
+        return convolve_masked_gauss(in_data, mask, extra_mask=extra_mask, **kernal_args)
+    kernal = _get_kernal(kernal_args)
+    if extra_mask is not None:
+        return convolve_masked_fused(in_data, mask, extra_mask, kernal, **density_args)
+    return convolve_masked(in_data, mask, kernal, **density_args)
+
+
 def calc_thresholds(data, downsample=0, segment_length=5, bias=60, sensitivity=1, quantile=90, **kwargs):
     '''Function to calculate the threshold for cloud pixels in the backscatter data.
     
@@ -148,39 +360,71 @@ def calc_thresholds(data, downsample=0, segment_length=5, bias=60, sensitivity=1
     print(f'{downsample=}')
     if downsample > 0:
         print('dda.calc_thresholds: downsampling matrix')
+        # precompute the vertical indices, ensuring they lie within the bounds of data
+        yy_range = np.arange(ny, dtype=np.int32)
+        ibot_arr = np.maximum(yy_range-downsample, 0).astype(np.int32)
+        itop_arr = np.minimum(yy_range+downsample, ny).astype(np.int32)
         for xx in range(nx):
             # ensure the indices lie within the bounds of data
-            ileft = np.max([0,xx-downsample])
-            iright = np.min([nx,xx+downsample])
+            ileft = 0 if xx < downsample else xx-downsample
+            iright = xx+downsample if xx+downsample < nx else nx
             for yy in range(ny):
-                ibot = np.max([0,yy-downsample])
-                itop = np.min([ny,yy+downsample])
                 # ignores nan values, unless all values are nan and then return nan.
-                downsample_matrix[yy,xx] = np.nanmax(data[ibot:itop,ileft:iright])
+                downsample_matrix[yy,xx] = np.nanmax(data[ibot_arr[yy]:itop_arr[yy],ileft:iright])
 
     # now need to access the downsampled matrix and perform the quantile calculations...
     print('dda.calc_thresholds: calculating thresholds')
     # NOTE: there are two approaches to the quantile calculation. Either the nans can be ignored, or considered as 0s. This will obvoiously impact the number of points being considered and thus the eventual quantile value. Change the following line ONLY to investigate this behaviour.
     downsample_matrix[np.isnan(downsample_matrix)] = 0 # this includes the nan values in the quantile calculation.
+    delta = 2*segment_length+1
+    thresholds = _threshold_loop(downsample_matrix, segment_length, delta, quantile, bias, sensitivity)
+
+    return thresholds
+
+
+@numba.njit(parallel=True, nogil=True, cache=True, fastmath=True)
+def _threshold_loop(downsample_matrix, segment_length, delta, quantile, bias, sensitivity):
+    '''Function to implement the threshold calculation loop with Numba JIT compilation, parallelised over the vertical profiles.
+
+    INPUTS:
+        downsample_matrix : np.ndarray
+            (nxm) matrix containing m vertical profiles of n height bins, with nan values already replaced, that will have quantiles calculated for.
+
+        segment_length : int
+            The number of columns either side of a given profile that are used in the quantile calculation.
+
+        delta : int
+            The stride between the columns used in the quantile calculation.
+
+        quantile : float
+            Value between 0 and 100 (%) specifying the quantile to be calculated.
+
+        bias : float
+            The constant bias used in the threshold calculation.
+
+        sensitivity : float
+            The linear coefficient used in the threshold calculation.
+
+    OUTPUTS:
+        thresholds : np.ndarray
+            (m,) array containing the cloud-threshold for each of the m vertical profiles.
+    '''
+    ny, nx = downsample_matrix.shape
     thresholds = np.zeros(nx)
-    for xx in range(nx):
-        # handle edge cases:
-        delta = 2*segment_length+1
-        if xx-segment_length*delta < 0 or xx+segment_length*delta >= nx:
-            for nn in np.arange(-segment_length,segment_length+1):
-                quantileData = np.array([])
-                if xx+nn*delta > 0 and xx+nn*delta<nx:
-                    quantileData = np.concatenate((quantileData,downsample_matrix[:,xx+nn*delta]))
-        # extract collums that have independant maximum values per pixel
-        else:
-            quantileData = downsample_matrix[:,xx-segment_length*delta:xx+segment_length*delta+1:delta]
-        quantile_value = np.nanquantile(quantileData,quantile/100)
+    for xx in numba.prange(nx):
+        # extract collums that have independant maximum values per pixel, skipping those outside of the bounds of the data at the edges
+        quantileData = np.empty(ny*(2*segment_length+1))
+        n_cols = 0
+        for nn in range(-segment_length, segment_length+1):
+            ix = xx + nn*delta
+            if ix >= 0 and ix < nx:
+                quantileData[n_cols*ny:(n_cols+1)*ny] = downsample_matrix[:,ix]
+                n_cols += 1
+        quantile_value = _nan_quantile(quantileData[:n_cols*ny], quantile/100)
         thresholds[xx] = bias + sensitivity*quantile_value
 
     return thresholds
 
-        
-
 
 def dda(in_data,
         kernal_args={}, density_args={}, threshold_args={}, 
@@ -200,7 +444,7 @@ def dda(in_data,
             Defaults to None, where default arguments will be used.
 
         density_args : dict
-            Dictionary containing arguments for the density calculation.
+            Dictionary containing arguments for the density calculation. Setting 'backend':'cupy' performs the convolutions on the GPU (see convolve_masked).
 
         threshold_args : dict
             Dictionary containing arguments for the threshold calculation.
@@ -244,11 +488,9 @@ def dda(in_data,
             kernal_args['kernalfunc'] = kernal_Gaussian
     else:
         kernal_args = {'kernalfunc':kernal_Gaussian}
-    kernal = kernal_args['kernalfunc'](**kernal_args)
-
     # calculate the density field from the data using the masked convolution
     mask = np.isnan(in_data)
-    density, norm = convolve_masked(in_data, mask, kernal, **density_args)
+    density, norm = _calc_density(in_data, mask, kernal_args, density_args)
     return_data['density_pass1'] = density
 
     # calculate the thresholds for the cloud-pixels from the masked density field, and calculate the cloud_mask as a result
@@ -264,33 +506,121 @@ def dda(in_data,
                 kernal_args2['kernalfunc'] = kernal_Gaussian
         else:
             kernal_args2 = kernal_args
-        kernal2 = kernal_args2['kernalfunc'](**kernal_args2)
     
         # TODO: implement noise in place of original clouds, rather than masked as 0 values (see ATBD pg135)
         if density_args2 == {}:
             density_args2 = density_args
-        mask2 = np.logical_or(cloud_mask,mask)
-        density2, norm = convolve_masked(in_data, mask2, kernal2, **density_args2)
+        # if pass 1 found no cloud, the pass 2 mask is the same as the pass 1 mask
+        clouds_in_pass1 = cloud_mask.any()
+        if not clouds_in_pass1 and kernal_args2 == kernal_args and density_args2 == density_args:
+            # the density field would be identical, so reuse it rather than convolving again
+            density2 = density
+        else:
+            # the pass-1 cloud pixels are masked out alongside the nan values
+            density2, norm = _calc_density(in_data, mask, kernal_args2, density_args2, extra_mask=cloud_mask if clouds_in_pass1 else None)
         return_data['density_pass2'] = density2
 
         if threshold_args2 == {}:
             threshold_args2 = threshold_args
-        thresholds2 = calc_thresholds(density2, **threshold_args2)
+        if density2 is density and threshold_args2 == threshold_args:
+            thresholds2 = thresholds
+        else:
+            thresholds2 = calc_thresholds(density2, **threshold_args2)
         return_data['thresholds2'] = thresholds2
         cloud_mask2 = np.greater(density2, thresholds2)
 
 
-        return_data['cloud_mask_passes'] = cloud_mask.astype(int) + 2*cloud_mask2.astype(int)
+        # encode the passes as bits (1: pass 1, 2: pass 2, 3: both) in a uint8 array, viewing the boolean masks as bytes to avoid integer temporaries
+        return_data['cloud_mask_passes'] = cloud_mask.view(np.uint8) | (cloud_mask2.view(np.uint8) << 1)
 
         # the final cloud mask is the combined set of determined cloud pixels from run 1 and run 2
-        cloud_mask = np.logical_or(cloud_mask, cloud_mask2)
+        np.logical_or(cloud_mask, cloud_mask2, out=cloud_mask)
 
-    cloud_mask = remove_small_objects(cloud_mask,min_size=300)
+    cloud_mask = _remove_small_clusters(cloud_mask, min_size)
     return_data['cloud_mask'] = cloud_mask
     
     return return_data
 
 
+@numba.njit(cache=True)
+def _find(parent, i):
+    '''Function to find the root of the cluster containing i in the disjoint-set parent array, halving the path as it goes.'''
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+@numba.njit(cache=True)
+def _union(parent, size, i, j):
+    '''Function to merge the clusters containing i and j, attaching the smaller cluster to the larger one.'''
+    ri = _find(parent, i)
+    rj = _find(parent, j)
+    if ri == rj:
+        return
+    if size[ri] < size[rj]:
+        ri, rj = rj, ri
+    parent[rj] = ri
+    size[ri] += size[rj]
+
+
+@numba.njit(cache=True)
+def _remove_small_clusters(cloud_mask, min_size):
+    '''Function to remove connected clusters of pixels smaller than min_size from a boolean mask.
+
+    This replicates skimage.morphology.remove_small_objects (with connectivity=1), but uses a single raster scan with a union-find to both label the clusters and accumulate their sizes, so no label image is created. The disjoint-set arrays have one entry per True pixel, with labels assigned in raster order.
+
+    INPUTS:
+        cloud_mask : np.ndarray (dtype=boolean)
+            2-dimensional numpy array containing the mask. This is modified in place.
+
+        min_size : int
+            Minimum size for cloud clusters to be, otherwise they're removed.
+
+    OUTPUTS:
+        cloud_mask : np.ndarray (dtype=boolean)
+            The input mask, with the small clusters removed.
+    '''
+    ny, nx = cloud_mask.shape
+    n_true = 0
+    for yy in range(ny):
+        for xx in range(nx):
+            if cloud_mask[yy,xx]:
+                n_true += 1
+
+    parent = np.empty(n_true, dtype=np.int32)
+    size = np.ones(n_true, dtype=np.int32)
+    # labels of the pixels in the previous and current rows, -1 where there is no cloud.
+    row_above = np.full(nx, -1, dtype=np.int32)
+    row_current = np.full(nx, -1, dtype=np.int32)
+
+    label = 0
+    for yy in range(ny):
+        for xx in range(nx):
+            if cloud_mask[yy,xx]:
+                parent[label] = label
+                if xx > 0 and row_current[xx-1] >= 0:
+                    _union(parent, size, label, row_current[xx-1])
+                if row_above[xx] >= 0:
+                    _union(parent, size, label, row_above[xx])
+                row_current[xx] = label
+                label += 1
+            else:
+                row_current[xx] = -1
+        row_above, row_current = row_current, row_above
+
+    # second scan revisits the pixels in the same order, so the labels can be regenerated by counting.
+    label = 0
+    for yy in range(ny):
+        for xx in range(nx):
+            if cloud_mask[yy,xx]:
+                if size[_find(parent, label)] < min_size:
+                    cloud_mask[yy,xx] = False
+                label += 1
+
+    return cloud_mask
+
+
 def dda_from_xarray(ds, dda_var, coord_height, coord_x, sel_args = {},**dda_kwargs):
     '''Implements dda but using xarray dataset as input.
     
@@ -343,9 +673,11 @@ def dda_from_xarray(ds, dda_var, coord_height, coord_x, sel_args = {},**dda_kwar
 
     # if they don't exist create the new dda_out variables in ds_in and populate them according to the selection rules
     # each output array in the dictionary should be of the shape (height, coord_x), and can thus be made like dda_var...
+    created = set()
     for k in dda_out:
         if ds.get(k) is None: 
             # if the variable doesn't already exist, create it
+            created.add(k)
             if dda_out[k].ndim == 2: # 2-D (image) output, same as input
                 ds[k] = xr.zeros_like(ds[dda_var])*np.nan
             else: # otherwise, is a series-like output
@@ -356,10 +688,51 @@ def dda_from_xarray(ds, dda_var, coord_height, coord_x, sel_args = {},**dda_kwar
 
         # in the desired area, fill in with dda_out[k], otherwise, maintain the current value of ds_in[k]
         if mask is not None:
-            ds[k] = xr.where(mask, dda_out[k], ds[k])
+            da = ds[k]
+            if all(dim in da.dims for dim in sel_args):
+                # write into the selected region of a copy, so that the arrays of the input dataset aren't modified. Variables created above are already new arrays
+                if k not in created:
+                    da = da.copy()
+                da.loc[sel_args] = dda_out[k]
+                ds[k] = da
+            else: # the selection dimensions need to be broadcast into ds[k]
+                ds[k] = xr.where(mask, dda_out[k], da)
         else:
             ds[k] = (ds[k].dims,dda_out[k])
 
     return ds
 
 
+
+
+def dda_batch(datasets, dda_var, coord_height, coord_x, sel_args={}, n_jobs=-1, **dda_kwargs):
+    '''Implements dda_from_xarray over a collection of independent datasets (e.g. granules), distributing them across processes.
+
+    INPUTS:
+        datasets : iterable of xr.Dataset
+            the datasets to run dda_from_xarray on.
+
+        dda_var, coord_height, coord_x, sel_args : see dda_from_xarray
+
+        n_jobs : int
+            The number of worker processes to use. -1 uses all available cores, and 1 runs the datasets sequentially in the current process.
+
+        dda_kwargs : all additional arguments used in dda()
+
+    OUTPUTS:
+        datasets_out : list of xr.Dataset
+            the output datasets from dda_from_xarray, in the same order as the input datasets.
+    '''
+    datasets = list(datasets)
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    n_jobs = max(1, min(n_jobs, len(datasets)))
+
+    if n_jobs == 1:
+        return [dda_from_xarray(ds, dda_var, coord_height, coord_x, sel_args, **dda_kwargs) for ds in datasets]
+
+    # each worker process computes its own kernals once, and reuses them through _KERNAL_CACHE
+    worker = functools.partial(dda_from_xarray, dda_var=dda_var, coord_height=coord_height, coord_x=coord_x, sel_args=sel_args, **dda_kwargs)
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        datasets_out = list(executor.map(worker, datasets))
+    return datasets_out
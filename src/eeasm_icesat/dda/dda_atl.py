@@ -8,6 +8,7 @@ import numpy as np
 import xarray as xr
 
 from . import steps
+from .steps.combine_masks import _inplace_or
 
 def dda_atl(data, heights, dem,
         kernal_args={}, density_args={}, threshold_args={}, 
@@ -93,13 +94,23 @@ def dda_atl(data, heights, dem,
         layer_mask : np.ndarray (dtype=bool)
             (n,m) numpy array containing the consolidated layer mask used to determine layer_bot and layer_top.
     '''
+    # the DDA is run in float32, which is sufficient precision for the backscatter and halves the memory bandwidth of each step
+    data = np.asarray(data, dtype=np.float32)
+
     # Threading: 1: Run DDA-atmos to determination of combined decluster mask [section 3.1 to 3.5]
     data_mask = np.isnan(data)
+    # the masked data is zeroed once, and reused for the density calculations
+    data_zeroed = np.where(data_mask, 0., data)
+    # the complement of data_mask is also calculated once, and updated in place for pass 2
+    valid = np.logical_not(data_mask)
+
+    # both kernals are independent of the data, so are created before the passes. Every other step depends on the one before it (pass 2 requires cloud_mask1), so the passes run in sequence.
+    kernal1 = steps.create_kernal.Gaussian_separable(**kernal_args, verbose=verbose)
+    kernal2 = steps.create_kernal.Gaussian_separable(**kernal_args2, verbose=verbose)
 
     if verbose: print('******** Starting pass 1')
 
-    kernal1 = steps.create_kernal.Gaussian(**kernal_args, verbose=verbose)
-    density1 = steps.calc_density(data, data_mask, kernal1, density_args, verbose)
+    density1 = steps.calc_density(data_zeroed, data_mask, kernal1, density_args, verbose, data_zeroed=True, valid=valid)
     thresholds1 = steps.calc_threshold(density1, data_mask, **threshold_args, verbose=verbose)
     if remove_clusters_in_pass:
         cloud_mask1 = steps.calc_cloud_mask(density1,thresholds1,data_mask, remove_small_clusters=min_cluster_size, verbose=verbose)
@@ -108,19 +119,22 @@ def dda_atl(data, heights, dem,
 
     if verbose: print('******** Starting pass 2')
 
-    kernal2 = steps.create_kernal.Gaussian(**kernal_args2, verbose=verbose)
     # update the data_mask variable to include cloud_mask1.
     if fill_clouds_with_noise:
         # determine what the noise mean and sd are
         # data[cloud_mask1] = np.rand(data.size,mean,sd)[cloud_mask1]
-        mean, sd = steps.calc_noise_at_height(data, cloud_mask1, heights, dem, noise_altitude, kernal_args['quantile'],verbose=verbose)
+        mean, sd = steps.calc_noise_at_height(data, cloud_mask1, heights, dem, noise_altitude, kernal_args['quantile'], data_mask=data_mask, verbose=verbose)
         data_with_noise = steps.replace_mask_with_noise(data,cloud_mask1,mean,sd,verbose=verbose)
 
-        density2 = steps.calc_density_field(data_with_noise ,data_mask, kernal2, **density_args2, verbose=verbose)
+        density2 = steps.calc_density(data_with_noise ,data_mask, kernal2, density_args2, verbose, valid=valid)
         del data_with_noise
     else:
-        data_mask = np.logical_or(data_mask, cloud_mask1)
-        density2 = steps.calc_density(data, data_mask, kernal2, density_args2, verbose)
+        _inplace_or(data_mask, cloud_mask1)
+        # only the pixels newly masked by cloud_mask1 need to be zeroed
+        data_zeroed[cloud_mask1] = 0
+        valid[cloud_mask1] = False
+        density2 = steps.calc_density(data_zeroed, data_mask, kernal2, density_args2, verbose, data_zeroed=True, valid=valid)
+    del data_zeroed, valid
     thresholds2 = steps.calc_threshold(density2, data_mask, **threshold_args2, verbose=verbose)
     if remove_clusters_in_pass:
         cloud_mask2 = steps.calc_cloud_mask(density2,thresholds2,data_mask, remove_small_clusters=min_cluster_size, verbose=verbose)
@@ -133,14 +147,14 @@ def dda_atl(data, heights, dem,
     # determine within which signal bins the ground lies
     (ground_bin, ground_height) = steps.get_ground_bin(density1, cloud_mask_combined, heights, dem, dem_tol, verbose=verbose)
 
-    layer_mask_with_ground = steps.combine_layers_from_mask_vectorized(cloud_mask_combined, verbose=verbose)
+    layer_mask_with_ground = steps.combine_layers_from_mask(cloud_mask_combined, verbose=verbose)
 
     if verbose: print('******** Removing ground from signal')
     # remove the ground bins from cloud_mask
     cloud_mask_no_ground, ground_mask = steps.remove_ground_from_mask(layer_mask_with_ground, ground_bin,cloud_mask_combined,ground_width,heights, verbose=verbose)
 
     # create a new layer_mask with the ground signal removed
-    layer_mask = steps.combine_layers_from_mask_vectorized(cloud_mask_no_ground, verbose=verbose)
+    layer_mask = steps.combine_layers_from_mask(cloud_mask_no_ground, verbose=verbose)
 
     if verbose: print('******** Calculating layer boundaries')
     num_cloud_layers, layer_bot, layer_top = steps.get_layer_boundaries(layer_mask,heights, verbose=verbose)
@@ -5,7 +5,9 @@ Function to caluclate the cloud mask, given the density field, thresholds and da
 '''
 
 import numpy as np
-from skimage.morphology import remove_small_objects
+from scipy import ndimage
+
+from .combine_masks import _inplace_andnot
 
 def calc_cloud_mask(density, threshold, data_mask=None, remove_small_clusters=0, verbose=False):
     '''Function to calculate the cloud mask from a density field and the associated thresholds.
@@ -21,7 +23,7 @@ def calc_cloud_mask(density, threshold, data_mask=None, remove_small_clusters=0,
             nxm numpy array determining which values in the input data are invalid. If not None, then regions of the cloud_mask will be set to 0 where data_mask is True. Otherwise, cloud_mask will not be affected.
 
         remove_small_clusters : int
-            Variable denoting how big the minimum cluster size can be in the mask. If a connected cluster of masked pixels (clouds) are smaller than this value, they will be removed according to skimage.morphology.remove_small_objects. If 0, no clusters are removed.
+            Variable denoting how big the minimum cluster size can be in the mask. If a connected cluster of masked pixels (clouds) are smaller than this value, they will be removed. If 0, no clusters are removed.
 
         verbose : bool
             Flag for printing out debug statements
@@ -31,12 +33,17 @@ def calc_cloud_mask(density, threshold, data_mask=None, remove_small_clusters=0,
             nxm numpy array containing cloudy pixels (1s) and non-cloudy pixels (0s).
     '''
     if verbose: print(f'===== dda.steps.calc_cloud_mask()')
-    cloud_mask = np.greater(density,threshold).astype(bool)
+    cloud_mask = density > threshold # already boolean, so no copy is needed
     if data_mask is not None:
-        cloud_mask[data_mask] = 0
+        _inplace_andnot(cloud_mask, data_mask)
 
     if remove_small_clusters > 0:
         if verbose: print(f'Removing small clusters of size {remove_small_clusters} or smaller.')
-        cloud_mask = remove_small_objects(cloud_mask,min_size=remove_small_clusters)
+        # label the connected clusters once, and remove those smaller than remove_small_clusters by their pixel counts
+        labels, _ = ndimage.label(cloud_mask)
+        sizes = np.bincount(labels.ravel())
+        sizes[0] = 0 # the background label
+        too_small = sizes < remove_small_clusters
+        cloud_mask = ~too_small[labels]
 
     return cloud_mask
\ No newline at end of file
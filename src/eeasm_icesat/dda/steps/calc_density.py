@@ -6,8 +6,9 @@ Function to calculate the density field from data and a data mask.
 
 import numpy as np
 from scipy.signal import convolve2d
+from scipy.ndimage import convolve1d
 
-def calc_density(data, data_mask, kernal, density_args, verbose=False):
+def calc_density(data, data_mask, kernal, density_args, verbose=False, data_zeroed=False, valid=None):
     '''Function to calculate the density field from data and a data_mask using the provided kernal.
     
     INPUTS:
@@ -23,16 +24,25 @@ def calc_density(data, data_mask, kernal, density_args, verbose=False):
         density_args: dictionary
             dictionary containing additional arguments for the calculation of the density field, namely, the other arguments in scipy.signal.convolve2d.
 
+        verbose : bool
+            Flag for printing out debug statements
+
+        data_zeroed : bool
+            Flag to indicate that the masked values in data have already been set to 0, so that convolve_masked doesn't need to make a masked copy of data.
+
+        valid : None, np.ndarray (dtype=boolean)
+            Precomputed complement of data_mask. If None, it is calculated in convolve_masked.
+
     OUTPUTS:
         density : np.ndarray
             nxm numpy array containing the density field of data.
     '''
     print('==== dda.steps.calc_density()')
-    density = convolve_masked(data, data_mask, kernal, **density_args)
+    density = convolve_masked(data, data_mask, kernal, data_zeroed=data_zeroed, valid=valid, **density_args)
     return density
 
 
-def convolve_masked(data, mask, kernal, **kwargs):
+def convolve_masked(data, mask, kernal, data_zeroed=False, valid=None, **kwargs):
     '''Function to perform a convolution of a kernal on masked data.
     
     The convention is that masked values are 1s in mask, and the data to convolve is 0s in the mask.
@@ -41,14 +51,20 @@ def convolve_masked(data, mask, kernal, **kwargs):
     !!!! The normalised density field is returned !!!!
 
     INPUTS:
-        data : np.ndarray
-            array containing the data for which we want to perform the masked convolution on
+        data : np.ndarray, dask.array.Array
+            array containing the data for which we want to perform the masked convolution on. If given as a dask array (chunked along-track), the convolutions are performed on each chunk in parallel, and a dask array is returned.
 
         mask : np.ndarray (dtype=boolean)
             array of the same shape as data that contains 1s where nans and masked values are, and 0s where the desired data exists.
 
-        kernal : np.ndarray
-            convolutional kernal
+        kernal : np.ndarray, tuple
+            convolutional kernal. If given as a tuple (kernal_0, kernal_1) of 1-dimensional kernals, the kernal is taken to be separable (equal to np.outer(kernal_0, kernal_1)), and the convolution is performed as two 1-dimensional passes along axes 0 and 1.
+
+        data_zeroed : bool
+            Flag to indicate that the masked values in data have already been set to 0. If False, a masked copy of data is made.
+
+        valid : None, np.ndarray (dtype=boolean)
+            Precomputed complement of mask (1s where the desired data exists), so that it can be reused between calls. If None, ~mask is used.
 
         kwargs : other arguments to be passed to np.convolve
 
@@ -61,11 +77,65 @@ def convolve_masked(data, mask, kernal, **kwargs):
         if arg in kwargs:
             convargs[arg] = kwargs[arg]
 
-    norm = convolve2d(~mask, kernal, **convargs)
-    masked_data = data.copy()
-    masked_data[mask] = 0
-    density = convolve2d(masked_data,kernal, **convargs)
+    if isinstance(kernal, tuple):
+        if convargs['mode'] == 'same':
+            conv = lambda arr: _convolve_separable(arr, kernal, convargs)
+        else: # the separable passes only support mode='same', so fall back to the full 2-dimensional kernal
+            kernal = np.outer(*kernal)
+            conv = lambda arr: convolve2d(arr, kernal, **convargs)
+    else:
+        conv = lambda arr: convolve2d(arr, kernal, **convargs)
+
+    if _is_dask_array(data):
+        conv = _dask_conv(conv, kernal, convargs)
+
+    if valid is None:
+        valid = ~mask
+    norm = conv(valid)
+    if data_zeroed:
+        masked_data = data
+    else:
+        masked_data = np.where(mask, 0., data) # single pass, rather than a copy followed by an indexed write
+    density = conv(masked_data)
 
     # normalise density field
-    density[norm>0] = density[norm>0] / norm[norm>0]
+    if _is_dask_array(density):
+        return np.where(norm>0, density/norm, density) # dask arrays don't support assignment with array-valued boolean indexing
+    np.divide(density, norm, out=density, where=norm>0)
     return density
+
+
+def _is_dask_array(arr):
+    '''Function to determine if arr is a dask array, without requiring dask to be installed.'''
+    return type(arr).__module__.split('.')[0] == 'dask'
+
+
+def _dask_conv(conv, kernal, convargs):
+    '''Function to wrap the numpy convolution function conv so that it is applied to each chunk of a dask array in parallel.
+
+    Each chunk is extended by a halo of half the kernal size from its neighbouring chunks, so the result matches the convolution of the full array. The edges of the full array are left to the boundary handling in conv.
+    '''
+    if convargs['mode'] != 'same':
+        msg = 'dda.steps.convolve_masked: only mode="same" is supported for dask arrays'
+        raise ValueError(msg)
+    if isinstance(kernal, tuple):
+        depth = (len(kernal[0])//2, len(kernal[1])//2)
+    else:
+        depth = (kernal.shape[0]//2, kernal.shape[1]//2)
+
+    def dask_conv(arr):
+        if not _is_dask_array(arr): # e.g. a precomputed numpy valid mask
+            return conv(arr)
+        return arr.map_overlap(conv, depth=depth, boundary='none', dtype=np.result_type(arr, np.float32))
+    return dask_conv
+
+
+# mapping of the scipy.signal.convolve2d boundary arguments to the equivalent scipy.ndimage modes
+_NDIMAGE_MODES = {'symm':'reflect', 'symmetric':'reflect', 'fill':'constant', 'wrap':'wrap', 'circular':'wrap'}
+
+def _convolve_separable(arr, kernals, convargs):
+    '''Function to convolve arr with a separable kernal, given as a tuple of 1-dimensional kernals for axes 0 and 1, with the same boundary handling as convolve2d(mode='same').'''
+    mode = _NDIMAGE_MODES[convargs['boundary']]
+    cval = convargs.get('fillvalue', 0)
+    out = convolve1d(arr, kernals[0], axis=0, mode=mode, cval=cval, output=np.result_type(arr, kernals[0], np.float32))
+    return convolve1d(out, kernals[1], axis=1, mode=mode, cval=cval)
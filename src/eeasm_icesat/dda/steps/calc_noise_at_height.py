@@ -5,8 +5,9 @@ Script containing function to calculate the noise profile at height of masked da
 '''
 
 import numpy as np
+import numba
 
-def calc_noise_at_height(data, cloud_mask, heights, dem, altitude, quantile, include_nans=False, smooth_bins=2, verbose=False):
+def calc_noise_at_height(data, cloud_mask, heights, dem, altitude, quantile, include_nans=False, smooth_bins=2, data_mask=None, verbose=False):
     '''Function to calculate the noise profile of the ATL09 data from high altitude measurements.
 
     This function calculates the noise by taking the mean and standard deviation of values in the data array that are a certain altitude above the dem and not contained in the cloud_mask from density1. The aim of this is to allow the filling of the cloud mask with noisy values with a reasonable power spectrum.
@@ -36,6 +37,9 @@ def calc_noise_at_height(data, cloud_mask, heights, dem, altitude, quantile, inc
         smooth_bins : int
             Number of profiles either side of a given profile over which a rolling average of mean and sd values are taken.
 
+        data_mask : None, np.ndarray (dtype=bool)
+            (n,m) numpy array containing the locations of the nan values in data, if already calculated. If None, it will be calculated from data.
+
         verbose : bool
             Flag for printing debug statements to the log
  
@@ -47,20 +51,17 @@ def calc_noise_at_height(data, cloud_mask, heights, dem, altitude, quantile, inc
             (n,) numpy array containing the smoothed standard deviation value for each vertical profile's noise spectrum.
     '''
     if verbose: print('==== dda.steps.calc_noise_at_height()')
-    (n_prof, n_vert) = data.shape
-    new_data = data.copy()
-    # create a mask based on bin altitude above ground level
-    delta_heights = heights.reshape((1,n_vert)) - dem.reshape(n_prof,1)
-    altitude_mask = delta_heights <= altitude
-    
-    # create the final data mask
-    data_mask = np.logical_or(altitude_mask, cloud_mask)
+    if data_mask is None:
+        data_mask = np.isnan(data)
+
+    # create the final data mask in a single pass, from the bin altitude above ground level, the cloud mask and the nan values
+    noise_mask = np.empty(data.shape, dtype=bool)
+    _build_noise_mask(heights, dem, cloud_mask, data_mask, altitude, noise_mask)
+    # nan values are always excluded from the quantile calculation
+    new_data = np.where(noise_mask, np.nan, data)
+    del noise_mask
     if include_nans:
-        data[np.isnan(data)] = 0
-    else:
-        data_mask = np.logical_or(data_mask, np.isnan(data))
-
-    new_data[data_mask] = np.nan
+        data[data_mask] = 0
 
     # calculate the quantile values for each vertical profile
     quant_vals = np.nanquantile(new_data,quantile/100, axis=1)
@@ -71,22 +72,99 @@ def calc_noise_at_height(data, cloud_mask, heights, dem, altitude, quantile, inc
     if verbose: print('Calculating mean and sd')
     mean = np.zeros_like(quant_vals)
     sd = np.zeros_like(quant_vals)
-    for i, prof in enumerate(data):
-        mean[i] = np.nanmean(prof[prof < quant_vals[i]])
-        sd[i] = np.nanstd(prof[prof < quant_vals[i]])
+    _noise_mean_sd(data, quant_vals, mean, sd)
 
     if smooth_bins > 0:
         if verbose: print('Smoothing mean and sd')
-        width = 2*smooth_bins + 1
-        mean = np.convolve(mean, np.ones(width)/width, mode='same')
-        sd = np.convolve(sd, np.ones(width)/width, mode='same')
+        mean = _box_smooth(mean, smooth_bins)
+        sd = _box_smooth(sd, smooth_bins)
 
     return mean, sd
 
-    
-    
 
+def _box_smooth(x, smooth_bins):
+    '''Function to calculate the rolling mean of x over 2*smooth_bins+1 values, using cumulative sums (O(n) rather than O(n*width)).
 
+    This is equivalent to np.convolve(x, np.ones(width)/width, mode='same'): values beyond the ends of x count as 0, and windows containing nan values return nan.
+    '''
+    width = 2*smooth_bins + 1
+    if x.size < width: # np.convolve returns an array of length width in this case
+        return np.convolve(x, np.ones(width)/width, mode='same')
+    nans = np.isnan(x)
+    # pad so that the output is the same length as x, and the cumulative sums start from 0
+    padded = np.pad(np.where(nans, 0, x), (smooth_bins+1, smooth_bins))
+    padded[0] = 0
+    csum = np.cumsum(padded)
+    smoothed = (csum[width:] - csum[:-width]) / width
+    if nans.any():
+        nan_count = np.cumsum(np.pad(nans, (smooth_bins+1, smooth_bins)))
+        smoothed[(nan_count[width:] - nan_count[:-width]) > 0] = np.nan
+    return smoothed
+
+
+@numba.njit(parallel=True, cache=True)
+def _build_noise_mask(heights, dem, cloud_mask, nan_mask, altitude, out_mask):
+    '''Function to create the mask of values excluded from the noise calculation in a single pass, parallelised over the profiles.
+
+    A value is masked if its bin is within altitude of the dem, it is cloudy, or it is nan.
 
+    INPUTS:
+        heights : np.ndarray
+            (m,) numpy array of the bin heights.
 
-    
+        dem : np.ndarray
+            (n,) numpy array of the dem heights.
+
+        cloud_mask, nan_mask : np.ndarray (dtype=bool)
+            (n,m) numpy arrays of the cloudy and nan pixels.
+
+        altitude : float
+            Altitude above the dem, at or below which bins are masked.
+
+        out_mask : np.ndarray (dtype=bool)
+            (n,m) numpy array the mask is written into.
+    '''
+    (n_prof, n_vert) = cloud_mask.shape
+    for i in numba.prange(n_prof):
+        ground = dem[i]
+        for j in range(n_vert):
+            out_mask[i,j] = (heights[j] - ground <= altitude) or cloud_mask[i,j] or nan_mask[i,j]
+
+
+# fastmath without the 'nnan' and 'ninf' flags, as the nan comparisons are needed to exclude nan values
+@numba.njit(parallel=True, fastmath={'nsz','arcp','contract','afn','reassoc'}, cache=True)
+def _noise_mean_sd(data, quant_vals, out_mean, out_sd):
+    '''Function to calculate the mean and standard deviation of the values below the quantile value in each profile, with Numba JIT compilation parallelised over the profiles.
+
+    The mean and standard deviation are accumulated in a single pass using Welford's algorithm. Profiles with no values below their quantile value are given nan.
+
+    INPUTS:
+        data : np.ndarray
+            (n,m) numpy array containing the profile data.
+
+        quant_vals : np.ndarray
+            (n,) numpy array containing the quantile value for each profile.
+
+        out_mean, out_sd : np.ndarray
+            (n,) numpy arrays that the mean and standard deviation for each profile are written into.
+    '''
+    (n_prof, n_vert) = data.shape
+    for i in numba.prange(n_prof):
+        q = quant_vals[i]
+        count = 0
+        m = 0.
+        m2 = 0.
+        for j in range(n_vert):
+            x = data[i,j]
+            # nan values fail the comparison, so are excluded
+            if x < q:
+                count += 1
+                d = x - m
+                m += d / count
+                m2 += d * (x - m)
+        if count > 0:
+            out_mean[i] = m
+            out_sd[i] = np.sqrt(m2 / count)
+        else:
+            out_mean[i] = np.nan
+            out_sd[i] = np.nan
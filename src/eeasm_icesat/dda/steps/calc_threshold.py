@@ -5,7 +5,9 @@ Function to calculate the cloud layer threshold, given the data matrix, a data m
 '''
 
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import numba
+from scipy import ndimage
 
 #@numba.jit()#nopython=True)
 def calc_threshold(density, data_mask=None, downsample=0, segment_length=5, bias=60, sensitivity=1, quantile=90, verbose=False, **kwargs):
@@ -61,9 +63,11 @@ def calc_threshold(density, data_mask=None, downsample=0, segment_length=5, bias
 
 
 
-@numba.jit(nopython=True)
+@numba.njit(parallel=True, cache=True)
 def _threshold_loop(n_prof, downsample, segment_length, downsample_matrix, quantile, bias, sensitivity):
-    '''Function to implement threshoold calculation loop with Numba JIT compillation
+    '''Function to implement threshoold calculation loop with Numba JIT compillation, parallelised over the profiles.
+
+    The quantile of each window is found by partial sorting (see _nan_quantile) rather than np.nanquantile.
     
     INPUTS:
         n_prof : int
@@ -91,31 +95,59 @@ def _threshold_loop(n_prof, downsample, segment_length, downsample_matrix, quant
         thresholds : np.ndarray
             (n,) array containing the cloud-threshold for each of the n vertical profiles
     '''
-    thresholds = np.zeros(n_prof)
-    for xx in range(n_prof):
+    n_vert = downsample_matrix.shape[1]
+    delta = 2*downsample+1
+    thresholds = np.zeros(n_prof, dtype=downsample_matrix.dtype) # keep the precision of the density field
+    for xx in numba.prange(n_prof):
         # handle edge cases:
-        delta = 2*downsample+1
         xleft = xx-segment_length*delta
         xright = xx+segment_length*delta
         if xleft < 0 or xright > n_prof-1:
-            xleft = np.max(np.array([0,xleft]))
-            xright = np.min(np.array([xright, n_prof-1]))
-        # extract collums that have independant maximum values per pixel
-        quantileData = downsample_matrix[xleft:xright+1:delta,:]
-
-        quantile_value = np.nanquantile(quantileData,quantile/100)
+            xleft = max(0, xleft)
+            xright = min(xright, n_prof-1)
+        # extract collums that have independant maximum values per pixel, keeping only the non-nan values
+        quantileData = np.empty((2*segment_length+1)*n_vert, dtype=downsample_matrix.dtype)
+        n_valid = 0
+        for ix in range(xleft, xright+1, delta):
+            for j in range(n_vert):
+                val = downsample_matrix[ix,j]
+                if not np.isnan(val):
+                    quantileData[n_valid] = val
+                    n_valid += 1
+
+        quantile_value = _nan_quantile(quantileData[:n_valid], quantile/100)
         thresholds[xx] = bias + sensitivity*quantile_value
 
     return thresholds
 
 
+@numba.njit(cache=True)
+def _nan_quantile(values, q):
+    '''Function to calculate the q-th quantile (0<=q<=1) of a 1-dimensional array of non-nan values, equivalent to np.nanquantile with linear interpolation.
 
-def calc_threshold_vectorized(density, data_mask=None, downsample=0, segment_length=5, bias=60, sensitivity=1, quantile=90, verbose=False, **kwargs):
+    np.partition is used to select the required order statistic in O(n), rather than sorting the values. An empty array returns nan, as with np.nanquantile on all-nan data.
+    '''
+    n = values.size
+    if n == 0:
+        return np.nan
+    pos = q * (n - 1)
+    k = int(np.floor(pos))
+    part = np.partition(values, k)
+    lower = part[k]
+    if k+1 >= n:
+        return lower
+    # after partitioning, the next order statistic is the minimum of the values above index k
+    upper = np.min(part[k+1:])
+    return lower + (pos-k)*(upper-lower)
+
+
+
+def calc_threshold_vectorized(density, data_mask=None, downsample=0, segment_length=5, bias=60, sensitivity=1, quantile=90, tile_size=1024, verbose=False, **kwargs):
     '''Function to calculate the threshold values for cloud pixels in each vertical profile of the density field.
     
     This function represents the synthesis of methods A and B in the ATL04/09 ATBD part 2 [https://doi.org/10.5067/48PJ5OUJOP4C]. The default arguments are for method B (although the bias and sensitivity values likely need changing for MPL data)
 
-    This version of the function is vectorized to improve speed of execution. It will however, be more memory intensive.
+    This version of the function is vectorized to improve speed of execution, using a strided window view over the profiles and a single nanquantile call. It will however, be more memory intensive.
 
     INPUTS:
         density : np.ndarray
@@ -139,6 +171,9 @@ def calc_threshold_vectorized(density, data_mask=None, downsample=0, segment_len
         quantile : float
             Value between 0 and 100 (in %), the quantile value that is to be used in the threshold calculation.
 
+        tile_size : int
+            The number of profiles for which the quantiles are calculated at once. Larger values use more memory.
+
         verbose : bool
             Flag for printing out debug statements
 
@@ -156,24 +191,20 @@ def calc_threshold_vectorized(density, data_mask=None, downsample=0, segment_len
     if data_mask is not None: # if the data mask is provided, set the masked values to nan. Otherwise, they will have some density value.
         downsample_matrix[data_mask] = np.nan
 
-    thresholds = np.zeros(n_prof)
-
-    if verbose: print('Creating denity_stacked.')
+    if verbose: print('Creating windowed view of the density.')
     delta = 2*downsample+1
-    pad_vals = np.arange(-segment_length,segment_length+1)*delta
-    # create the large data array to store all the values for the window
-    density_stacked = np.zeros((n_prof, (2*segment_length+1)*n_vert))
-    if verbose: print(f'{density_stacked.shape=}')
-
-    for i, pad in enumerate(pad_vals):
-        if pad < 0: # left pad for pad less than zero
-            pad_mat = np.pad(downsample_matrix,((0,0),(-pad,0)),constant_values=(np.nan))[:,:pad]
-        else: # paddings greater than 0 are right-padded
-            pad_mat = np.pad(downsample_matrix,((0,0),(0,pad)),constant_values=(np.nan))[:,pad:]
-
-        density_stacked[:, i*n_vert:(i+1)*n_vert] = pad_mat
-
-    thresholds = bias + sensitivity* np.nanquantile(density_stacked,quantile/100,axis=1)
+    window = 2*segment_length*delta+1
+    # pad the profile axis with nans, so that windows at the edges only contain the valid profiles
+    padded = np.pad(downsample_matrix, ((segment_length*delta,segment_length*delta),(0,0)), constant_values=np.nan)
+    # zero-copy view of shape (n_prof, 2*segment_length+1, n_vert), taking every delta-th profile in each window
+    density_windows = sliding_window_view(padded, window, axis=0)[:,:,::delta].transpose(0,2,1)
+    if verbose: print(f'{density_windows.shape=}')
+
+    # the reshape copies the windows, so the quantiles are calculated in tiles of profiles to limit the peak memory
+    thresholds = np.zeros(n_prof, dtype=np.result_type(downsample_matrix.dtype, np.float32))
+    for start in range(0, n_prof, tile_size):
+        tile = density_windows[start:start+tile_size]
+        thresholds[start:start+tile_size] = bias + sensitivity* np.nanquantile(tile.reshape(tile.shape[0],-1),quantile/100,axis=1)
 
     thresholds = np.expand_dims(thresholds,axis=-1) # set the shape to (n,1) rather than (n,) for broadcasting when calculating cloud_mask
     return thresholds
@@ -199,20 +230,16 @@ def _downsample_matrix(density,downsample, verbose=False):
             (n,m) numpy array containing the values for the downsampled density matrix
     '''
     # perform the downsampling first on a profile-by-profile basis
-    (n_prof,n_vert) = density.shape
     downsample_matrix = density
     
     if downsample > 0:
         if verbose: print('Downsampling matrix.')
-        downsample_matrix = density.copy() # only copy the data if downsampling is required
-        for xx in range(n_prof):
-            # ensure the indices lie within the bounds of data
-            ileft = np.max([0,xx-downsample])
-            iright = np.min([n_prof,xx+downsample])
-            for yy in range(n_vert):
-                ibot = np.max([0,yy-downsample])
-                itop = np.min([n_vert,yy+downsample])
-                # ignores nan values, unless all values are nan and then return nan.
-                downsample_matrix[xx,yy] = np.nanmax(density[ileft:iright,ibot:itop])
+        # nan values are ignored by filling them with -inf, unless all values in the window are nan and then they return nan.
+        filled = np.where(np.isnan(density), -np.inf, density)
+        # the square maximum filter is separable, so is applied as a 1-dimensional filter along each axis
+        # mode='nearest' repeats the edge values, which is equivalent to clipping the window at the edges for a maximum
+        downsample_matrix = ndimage.maximum_filter1d(filled, size=2*downsample+1, axis=0, mode='nearest')
+        ndimage.maximum_filter1d(downsample_matrix, size=2*downsample+1, axis=1, mode='nearest', output=downsample_matrix)
+        downsample_matrix[np.isneginf(downsample_matrix)] = np.nan
     
     return downsample_matrix
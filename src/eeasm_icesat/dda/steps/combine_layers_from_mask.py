@@ -5,6 +5,8 @@ The function to perform the up- and down-passes on the consolidated cloud mask t
 '''
 
 import numpy as np
+import numba
+from scipy import ndimage
 
 def combine_layers_from_mask(cloud_mask, min_depth=3, min_sep=3, verbose=False):
     '''Function to perform up- and down-passes on cloud_mask to create layers with the minimum depth and separation.
@@ -27,53 +29,180 @@ def combine_layers_from_mask(cloud_mask, min_depth=3, min_sep=3, verbose=False):
             nxm numpy array containing 1s for cloudy pixels and 0s for non-cloudy pixels. This has cloud layers of a minimum thickness and layers with a minimum separation.
     '''
     if verbose: print('==== dda.steps.combine_layers_from_mask()')
+    buffer = int(np.max([min_depth,min_sep]))
     (n_prof, n_vert) = cloud_mask.shape
-    buffer = np.max([min_depth,min_sep])
-    layer_mask = np.zeros_like(cloud_mask)
+    # pack each profile into little-endian uint64 words, so that bin j is bit j%64 of word j//64
+    n_words = (n_vert + 63) // 64
+    packed_u8 = np.zeros((n_prof, 8*n_words), dtype=np.uint8)
+    packed_u8[:, :(n_vert+7)//8] = np.packbits(cloud_mask, axis=1, bitorder='little')
+    packed = packed_u8.view('<u8')
+    layer_packed = np.zeros_like(packed)
+
+    _combine_layers_packed(packed, layer_packed, n_vert, min_depth, min_sep, buffer)
+
+    return np.unpackbits(layer_packed.view(np.uint8), axis=1, count=n_vert, bitorder='little').view(bool) # zero-copy, as the unpacked bits are 0 or 1
+
+
+_ONE = np.uint64(1)
+_ALL = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+@numba.njit(cache=True)
+def _shifted_word(words, w, k):
+    '''Function to return word w of the row of packed bits, shifted so that bit j holds bin j+k (k may be negative). Bins outside of the row are 0.'''
+    n_words = words.size
+    q = k // 64
+    r = k - 64*q # 0 <= r < 64
+    src = w + q
+    out = np.uint64(0)
+    if 0 <= src < n_words:
+        out = words[src] >> np.uint64(r)
+    if r > 0 and 0 <= src+1 < n_words:
+        out |= words[src+1] << np.uint64(64-r)
+    return out
+
+
+@numba.njit(cache=True)
+def _run_words(words, n_words, run, direction, out):
+    '''Function to find the bins that start a run of at least run set bits, in the direction given by direction (+1 for increasing bin index, -1 for decreasing).
+
+    Each shift-and-AND tests the next bin of the run for 64 bins at once.
+    '''
+    for w in range(n_words):
+        acc = words[w]
+        for k in range(1, run):
+            acc &= _shifted_word(words, w, direction*k)
+        out[w] = acc
+
+
+@numba.njit(cache=True)
+def _bit_range_mask(w, start, stop):
+    '''Function to return the mask of the bits in word w that correspond to bins in [start, stop).'''
+    lo = max(start - 64*w, 0)
+    hi = min(stop - 64*w, 64)
+    if hi <= lo:
+        return np.uint64(0)
+    if hi - lo == 64:
+        return _ALL
+    return ((_ONE << np.uint64(hi - lo)) - _ONE) << np.uint64(lo)
+
+
+@numba.njit(cache=True)
+def _fill_bits(words, start, stop):
+    '''Function to set the bits for the bins in [start, stop) in the row of packed words.'''
+    if stop <= start:
+        return
+    for w in range(start // 64, (stop - 1) // 64 + 1):
+        words[w] |= _bit_range_mask(w, start, stop)
+
+
+@numba.njit(cache=True)
+def _lowest_bit(x):
+    '''Function to return the index of the lowest set bit of the non-zero uint64 x.'''
+    b = 0
+    for shift in (32, 16, 8, 4, 2, 1):
+        if x & ((_ONE << np.uint64(shift)) - _ONE) == 0:
+            x >>= np.uint64(shift)
+            b += shift
+    return b
+
+
+@numba.njit(cache=True)
+def _highest_bit(x):
+    '''Function to return the index of the highest set bit of the non-zero uint64 x.'''
+    b = 0
+    for shift in (32, 16, 8, 4, 2, 1):
+        if x >> np.uint64(shift) != 0:
+            x >>= np.uint64(shift)
+            b += shift
+    return b
+
+
+@numba.njit(parallel=True, cache=True)
+def _combine_layers_packed(packed, layer_packed, n_vert, min_depth, min_sep, buffer):
+    '''Function to perform the up- and down-passes for each profile on bit-packed rows, with Numba JIT compilation parallelised over the profiles.
 
-    for i, profile in enumerate(cloud_mask):
-        # for each vertical profile
-        cm_up = np.zeros_like(profile).astype(bool) # cloud masks that will be consolidated
-        cm_down = np.zeros_like(profile).astype(bool)
+    In each pass, the cloud state only changes at a "trigger": a cloudy bin starting min_depth cloudy bins (entering a layer) or a clear bin starting min_sep clear bins (leaving a layer), counted in the direction of the pass.
+    The triggers are found 64 bins at a time with shifted bitwise ANDs, and the layers are then filled between consecutive triggers, so that the per-bin work is done on whole words.
 
-        #upwards pass
+    INPUTS:
+        packed : np.ndarray (dtype=np.uint64)
+            (n, n_words) numpy array of the cloud mask, with each profile packed into words.
+
+        layer_packed : np.ndarray (dtype=np.uint64)
+            (n, n_words) numpy array of zeros, which is filled in place with the packed layer mask.
+
+        n_vert : int
+            the number of vertical bins in each profile.
+
+        min_depth, min_sep : int
+            see combine_layers_from_mask
+
+        buffer : int
+            the maximum of min_depth and min_sep, the number of bins at the ends of the profiles that each pass doesn't consider.
+    '''
+    (n_prof, n_words) = packed.shape
+    for i in numba.prange(n_prof):
+        ones = packed[i]
+        zeros = np.empty(n_words, dtype=np.uint64)
+        for w in range(n_words):
+            zeros[w] = ~ones[w] & _bit_range_mask(w, 0, n_vert)
+        enter = np.empty(n_words, dtype=np.uint64)
+        leave = np.empty(n_words, dtype=np.uint64)
+        out = layer_packed[i]
+
+        #upwards pass, over the bins [0, n_vert-buffer)
+        _run_words(ones, n_words, min_depth, 1, enter)
+        _run_words(zeros, n_words, min_sep, 1, leave)
         inCloud = False
-        for j,b in enumerate(profile[:-buffer]):
-            # b is a bool, 1 for cloud, 0 for not
-            if b and not inCloud:
-                # if there are min_depth_bins 1s in a row, this should evaluate as True
-                if np.all(profile[j:j+min_depth] == 1):
-                    inCloud=True
-            elif not b and inCloud:
-                # if there are min_sep_bins 0s in a row, this should evaluate as True
-                if np.all(profile[j:j+min_sep] == 0):
+        top = 0
+        for w in range(n_words):
+            valid = _bit_range_mask(w, 0, n_vert-buffer)
+            e = enter[w] & valid
+            l = leave[w] & valid
+            t = e | l
+            while t != 0:
+                b = _lowest_bit(t)
+                j = 64*w + b
+                bit = _ONE << np.uint64(b)
+                if (e & bit) != 0 and not inCloud:
+                    inCloud = True
+                    top = j
+                elif (l & bit) != 0 and inCloud:
+                    _fill_bits(out, top, j)
                     inCloud = False
-            cm_up[j] = inCloud
+                t &= t - _ONE # clear the lowest set bit
+        if inCloud:
+            _fill_bits(out, top, n_vert-buffer)
 
-        # downwards pass
+        # downwards pass, over the bins [buffer, n_vert), combining the up and down pass to consolidate the cloud layers
+        _run_words(ones, n_words, min_depth, -1, enter)
+        _run_words(zeros, n_words, min_sep, -1, leave)
         inCloud = False
-        for j,b in enumerate(profile[:buffer-1:-1]):
-            jdash = n_vert-j
-            if b and not inCloud:
-                # if there are min_depth_bins 1s in a row, this should evaluate as True
-                if np.all(profile[jdash-min_depth:jdash] == 1):
-                    inCloud=True
-            elif not b and inCloud:
-                # if there are min_sep_bins 0s in a row, this should evaluate as True
-                if np.all(profile[jdash-min_sep:jdash] == 0):
+        top = 0
+        for w in range(n_words-1, -1, -1):
+            valid = _bit_range_mask(w, buffer, n_vert)
+            e = enter[w] & valid
+            l = leave[w] & valid
+            t = e | l
+            while t != 0:
+                b = _highest_bit(t)
+                j = 64*w + b
+                bit = _ONE << np.uint64(b)
+                if (e & bit) != 0 and not inCloud:
+                    inCloud = True
+                    top = j
+                elif (l & bit) != 0 and inCloud:
+                    _fill_bits(out, j+1, top+1)
                     inCloud = False
-            cm_down[jdash-1] = inCloud
-
-        # we now combine the up and down pass to consolidate the cloud layers
-        cm = np.logical_or(cm_up,cm_down)
-        layer_mask[i,:] = cm
-
-    return layer_mask
+                t &= ~bit
+        if inCloud:
+            _fill_bits(out, buffer, top+1)
 
 
 def combine_layers_from_mask_vectorized(cloud_mask, min_depth=3, min_sep=3, verbose=False):
     '''Function to perform up- and down-passes on cloud_mask to create layers with the minimum depth and separation.
-    The function is intended to be vectorized to speed up the application of the DDA.
+    The function is intended to be vectorized to speed up the application of the DDA. Rather than stepping through the bins, the layers are found from the runs of cloudy and clear bins in each profile, which gives the same result as the up- and down-passes without the per-bin state machine.
     
     INPUTS:
         cloud_mask : np.ndarray (dtype=boolean)
@@ -96,32 +225,54 @@ def combine_layers_from_mask_vectorized(cloud_mask, min_depth=3, min_sep=3, verb
     (n_prof, n_vert) = cloud_mask.shape
     buffer = np.max([min_depth,min_sep])
 
-    layer_mask = np.zeros_like(cloud_mask)
-    cm_up = np.zeros_like(cloud_mask)
-    cm_down = np.zeros_like(cloud_mask)
+    cloud_mask = np.asarray(cloud_mask, dtype=bool)
+    # the up- and down-passes are in a layer from the start of a run of min_depth cloudy bins until the start of a gap of min_sep clear bins.
+    # so a layer is a cluster of cloudy runs separated by gaps shorter than min_sep, that contains at least one run of min_depth cloudy bins.
+    if verbose: print('Finding cloudy runs and clear gaps.')
+    clusters = ~_runs_at_least(~cloud_mask, min_sep)
+    deep = _runs_at_least(cloud_mask, min_depth)
 
-    inCloud = np.zeros((n_prof,)).astype(bool)
-    # perform the up-pass
-    if verbose: print('Performing up-pass.')
-    for j in range(n_vert-buffer):
-        cloud_mask_layer = cloud_mask[:,j].squeeze()
-    
-        change_in = ((1 - inCloud) * cloud_mask_layer * np.all(cloud_mask[:,j:j+min_depth] == 1, axis=1).squeeze()).astype(bool)
-        change_out = ((1 - cloud_mask_layer) * inCloud * np.all(cloud_mask[:,j:j+min_sep] == 0, axis=1).squeeze()).astype(bool)
-        inCloud = np.logical_xor(inCloud, change_out) + change_in
-        cm_up[:,j] = inCloud
-    
-    inCloud = np.zeros((n_prof,)).astype(bool)
-    # perform the down-pass
-    if verbose: print('Performing down-pass.')
-    for j in range(n_vert-1,buffer-1,-1):
-        cloud_mask_layer = cloud_mask[:,j].squeeze()
-
-        change_in = ((1-inCloud) * cloud_mask_layer * np.all(cloud_mask[:,j-min_depth+1:j+1] == 1, axis=1).squeeze())
-        change_out = ((1-cloud_mask_layer) * inCloud * np.all(cloud_mask[:,j-min_sep+1:j+1] == 0, axis=1).squeeze())
-        inCloud = inCloud + change_in - change_out
-        inCloud = inCloud.astype(bool)
-        cm_down[:,j] = inCloud
-
-    layer_mask = np.logical_or(cm_up,cm_down)
-    return layer_mask
\ No newline at end of file
+    # away from the ends of the profiles, both passes are performed, so the layers are the clusters containing a deep run
+    if verbose: print('Finding clusters containing deep runs.')
+    labels, n_labels = ndimage.label(clusters, structure=[[0,0,0],[1,1,1],[0,0,0]]) # clusters are only connected along the profile
+    has_deep = np.bincount(labels[deep], minlength=n_labels+1) > 0
+    has_deep[0] = False # the background label
+    layer_mask = has_deep[labels]
+    del labels
+
+    # within buffer bins of the ends of the profiles, only one pass is performed.
+    # the up-pass is in a layer once a deep run has started in the cluster, and the down-pass until the last deep run in the cluster has ended.
+    if verbose: print('Performing up- and down-passes at the ends of the profiles.')
+    lo = min(buffer, n_vert) # the bins [0, lo) are only in the up-pass
+    hi = max(n_vert-buffer, 0) # the bins [hi, n_vert) are only in the down-pass
+    layer_mask[:,:lo] = _deep_run_started(deep[:,:lo], clusters[:,:lo])
+    # the down-pass is the up-pass on the reversed profiles
+    layer_mask[:,hi:] = _deep_run_started(deep[:,hi:][:,::-1], clusters[:,hi:][:,::-1])[:,::-1]
+    layer_mask[:,hi:lo] = False # if the profiles are shorter than 2*buffer, the bins in the middle are in neither pass
+
+    return layer_mask
+
+
+def _runs_at_least(mask, length):
+    '''Function to find the bins of mask that are in a run of at least length consecutive True bins along axis=1, using shifted bitwise ANDs and ORs.'''
+    # bins that start a run of length True bins
+    starts = mask.copy()
+    for k in range(1, length):
+        starts[:,:-k] &= mask[:,k:]
+        starts[:,max(mask.shape[1]-k, 0):] = False
+    # extend the starts over the whole run
+    runs = starts.copy()
+    for k in range(1, length):
+        runs[:,k:] |= starts[:,:-k]
+    return runs
+
+
+def _deep_run_started(deep, clusters):
+    '''Function to find the bins in clusters where a deep run has started at or before the bin within the same cluster, along axis=1.
+
+    The last "event" (a deep bin, or a bin outside of clusters) at or before each bin is found with a cumulative maximum of the event bin indices, encoded so that deep bins are odd.
+    '''
+    n_vert = deep.shape[1]
+    code = np.arange(0, 2*n_vert, 2, dtype=np.int32) + deep
+    last_event = np.maximum.accumulate(np.where(deep | ~clusters, code, -2), axis=1)
+    return (last_event & 1).astype(bool) & clusters
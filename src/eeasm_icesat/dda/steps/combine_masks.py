@@ -5,14 +5,14 @@ A function to logically combine cloud masks, with the option to remove small clu
 '''
 
 import numpy as np
-from skimage.morphology import remove_small_objects
+from scipy import ndimage
 
 def combine_masks(masks, remove_small_clusters=0, verbose=False):
     '''Function to logically combine multiple cloud masks, with the option to remove small clusters of pixels afterwards.
     
     INPUTS:
-        masks : iterable of (n,m) np.ndarrays (dtype=boolean)
-            Iterable of numpy ndarrays that are all boolean and the same shape. These are the individual cloud masks, with 1s indicating cloud and 0 indicating cloud-free pixels.
+        masks : iterable of (n,m) np.ndarrays (dtype=boolean), np.ndarray
+            Iterable of numpy ndarrays that are all boolean and the same shape. These are the individual cloud masks, with 1s indicating cloud and 0 indicating cloud-free pixels. Can also be given as a (k,n,m) numpy array of k stacked masks.
 
         remove_small_clusters : int
             Variable denoting the minimum cluster size for pixels to be considered in the cloud mask. If 0, no clusters of pixels will be removed.
@@ -25,13 +25,55 @@ def combine_masks(masks, remove_small_clusters=0, verbose=False):
             nxm numpy array containing the logically combined cloud masks, that has had small clusters removed.
     '''
     if verbose: print('==== dda.steps.combine_masks')
-    combined_mask = np.zeros_like(masks[0])
-    for m in masks:
-        combined_mask = np.logical_or(combined_mask, m)
+    if isinstance(masks, np.ndarray) and masks.ndim == 3: # masks stacked along axis 0 are combined in a single reduction
+        combined_mask = np.any(masks, axis=0)
+    else:
+        masks = iter(masks)
+        combined_mask = np.array(next(masks), dtype=bool) # copy, so that the input masks aren't modified
+        for m in masks:
+            _inplace_or(combined_mask, m)
 
     if remove_small_clusters > 0:
         print('Removing small objects.')
-        combined_mask = remove_small_objects(combined_mask, min_size=remove_small_clusters)
+        # label the connected clusters once, and remove those smaller than remove_small_clusters by their pixel counts
+        labels, _ = ndimage.label(combined_mask)
+        sizes = np.bincount(labels.ravel())
+        sizes[0] = 0 # the background label
+        too_small = sizes < remove_small_clusters
+        combined_mask = ~too_small[labels]
         print('Small objects removed.')
 
-    return combined_mask
\ No newline at end of file
+    return combined_mask
+
+
+def _word_views(mask):
+    '''Function to return views of a contiguous boolean mask as 8-byte words and the remaining tail bytes, so that bitwise operations act on 8 pixels per operation whatever the size of mask.'''
+    flat = mask.reshape(-1).view(np.uint8)
+    n_words = flat.size // 8
+    return flat[:8*n_words].view(np.uint64), flat[8*n_words:]
+
+
+def _inplace_or(mask, other):
+    '''Function to perform mask |= other for boolean arrays of the same shape, in place and without branching.
+
+    The bitwise operations on the words are only correct for boolean bytes (0 or 1), so a non-boolean other is cast to boolean first (as np.logical_or would treat it), and a non-boolean mask uses np.logical_or.
+    '''
+    other = np.asarray(other, dtype=bool) # no copy if other is already boolean
+    if mask.dtype == bool and mask.flags.c_contiguous and other.flags.c_contiguous:
+        for m, o in zip(_word_views(mask), _word_views(other)):
+            np.bitwise_or(m, o, out=m)
+    else:
+        np.logical_or(mask, other, out=mask)
+    return mask
+
+
+def _inplace_andnot(mask, other):
+    '''Function to perform mask &= ~other for boolean arrays of the same shape, in place and without branching. As in _inplace_or, a non-boolean other is cast to boolean first.'''
+    other = np.asarray(other, dtype=bool)
+    if mask.dtype == bool and mask.flags.c_contiguous and other.flags.c_contiguous:
+        # as each boolean byte is 0 or 1, ~o is 0xFE or 0xFF in each byte, which clears or preserves the bytes of m
+        for m, o in zip(_word_views(mask), _word_views(other)):
+            np.bitwise_and(m, ~o, out=m)
+    else:
+        np.logical_and(mask, np.logical_not(other), out=mask)
+    return mask
@@ -4,6 +4,8 @@ Creation Date: 20/6/23
 Functions for cerating kernals for use in the DDA algorithm.
 '''
 
+import functools
+
 import numpy as np
 
 def Gaussian(sigma_y, sigma_x=None, a_m=None, cutoff=None, n=None, m=None, dx=1,dy=1, verbose=False, **kwargs):
@@ -45,8 +47,8 @@ def Gaussian(sigma_y, sigma_x=None, a_m=None, cutoff=None, n=None, m=None, dx=1,
         **kwargs : any additional arguments. These won't be used however.
 
     OUTPUTS:
-        kernal : np.ndarray
-            2-dimensional numpy array for the Gaussian kernal.
+        kernal : np.ndarray (dtype=np.float32)
+            2-dimensional numpy array for the Gaussian kernal. Kernals are cached for repeated arguments, so the returned array is read-only.
     '''
     if verbose: print('==== dda.steps.create_kernal.Gaussian()')
     if sigma_x is None:
@@ -55,16 +57,81 @@ def Gaussian(sigma_y, sigma_x=None, a_m=None, cutoff=None, n=None, m=None, dx=1,
             raise ValueError
         sigma_x = sigma_y * a_m
     
+    try:
+        kernal = _gaussian_cached(sigma_y, sigma_x, cutoff, n, m, dx, dy)
+    except TypeError: # unhashable arguments can't be cached, so compute the kernal directly
+        kernal = _gaussian(sigma_y, sigma_x, cutoff, n, m, dx, dy)
+    if verbose:
+        print(f'{kernal.shape=}')
+    return kernal
+
+
+def Gaussian_separable(sigma_y, sigma_x=None, a_m=None, cutoff=None, n=None, m=None, dx=1,dy=1, verbose=False, **kwargs):
+    '''Function to calculate and return a normalised Gaussian kernal as its separable 1-dimensional components.
+
+    The arguments are the same as for Gaussian, and the components satisfy np.outer(kernal_x, kernal_y) == Gaussian(...) (to floating point precision). The tuple can be passed as the kernal to calc_density, which performs the convolution as two 1-dimensional passes along axes 0 and 1.
+
+    OUTPUTS:
+        kernal_x : np.ndarray (dtype=np.float32)
+            (m,) numpy array for the normalised Gaussian in the horizontal direction (axis=0).
+
+        kernal_y : np.ndarray (dtype=np.float32)
+            (n,) numpy array for the normalised Gaussian in the vertical direction (axis=1).
+    '''
+    if verbose: print('==== dda.steps.create_kernal.Gaussian_separable()')
+    if sigma_x is None:
+        if a_m is None:
+            print('dda.steps.create_kernal.Gaussian_separable: a_m and sigma_x undefined')
+            raise ValueError
+        sigma_x = sigma_y * a_m
+
+    try:
+        kernal_x, kernal_y = _gaussian_separable_cached(sigma_y, sigma_x, cutoff, n, m, dx, dy)
+    except TypeError: # unhashable arguments can't be cached, so compute the kernal directly
+        kernal_x, kernal_y = (k.astype(np.float32) for k in _gaussian_1d(sigma_y, sigma_x, cutoff, n, m, dx, dy))
+    if verbose:
+        print(f'{kernal_x.shape=}  |  {kernal_y.shape=}')
+    return kernal_x, kernal_y
+
+
+def _gaussian_1d(sigma_y, sigma_x, cutoff, n, m, dx, dy):
+    '''Function to calculate the normalised 1-dimensional Gaussians in x (axis=0) and y (axis=1), whose outer product is the Gaussian kernal.'''
     if cutoff is not None:
         n = 2 * np.round(sigma_y/dy * cutoff) + 1
         m = 2 * np.round(sigma_x/dx * cutoff) + 1
+    n, m = int(n), int(m)
 
     x = np.arange(-(m//2), m//2+1)*dx
     y = np.arange(-(n//2), n//2+1)*dy
-    X,Y = np.meshgrid(y,x) # order reversed due to x,y definition of indices in this library
-    if verbose:
-        print(f'({n=}, {m=})  {X.shape=}')
-    gaussian = lambda x,y,sx,sy: np.exp(-0.5 * (np.power(x/sx, 2) + np.power(y/sy, 2)))
-    
-    kernal = gaussian(X,Y,sigma_y,sigma_x)
-    return kernal / np.sum(kernal) # return the normalised version of the kernal
+    gaussian = lambda x,s: np.exp(-0.5 * np.power(x/s, 2))
+    gx = gaussian(x,sigma_x)
+    gy = gaussian(y,sigma_y)
+    return gx/np.sum(gx), gy/np.sum(gy)
+
+
+def _gaussian(sigma_y, sigma_x, cutoff, n, m, dx, dy):
+    '''Function to calculate the normalised Gaussian kernal, see Gaussian.'''
+    # the Gaussian is separable, so the kernal is the outer product of the 1-dimensional Gaussians in x (axis=0) and y (axis=1)
+    gx, gy = _gaussian_1d(sigma_y, sigma_x, cutoff, n, m, dx, dy)
+    # return the kernal in float32 to match the precision the DDA is run at
+    return np.outer(gx, gy).astype(np.float32)
+
+
+@functools.lru_cache(maxsize=8)
+def _gaussian_cached(sigma_y, sigma_x, cutoff, n, m, dx, dy):
+    '''Function to return the Gaussian kernal for the given arguments, reusing previously computed kernals (e.g. when processing many granules with the same configuration).
+
+    The cached kernals are set to read-only, as they are shared between calls.
+    '''
+    kernal = _gaussian(sigma_y, sigma_x, cutoff, n, m, dx, dy)
+    kernal.setflags(write=False)
+    return kernal
+
+
+@functools.lru_cache(maxsize=8)
+def _gaussian_separable_cached(sigma_y, sigma_x, cutoff, n, m, dx, dy):
+    '''Function to return the separable Gaussian kernal components for the given arguments, reusing previously computed kernals. As in _gaussian_cached, the cached components are read-only.'''
+    kernals = tuple(k.astype(np.float32) for k in _gaussian_1d(sigma_y, sigma_x, cutoff, n, m, dx, dy))
+    for k in kernals:
+        k.setflags(write=False)
+    return kernals
@@ -5,6 +5,9 @@ Function to get the ground return bin in the data (if it exists) by checking bin
 '''
 
 import numpy as np
+import numba
+
+from .get_layer_boundaries import _height_order
 
 def get_ground_bin(density, cloud_mask, heights, dem, dem_tol, verbose=False):
     '''Function to get the bin associated with the ground return signal.
@@ -42,46 +45,35 @@ def get_ground_bin(density, cloud_mask, heights, dem, dem_tol, verbose=False):
     '''
     if verbose: print('==== dda.steps.get_ground_bin()')
     (n_prof,n_vert) = density.shape
-    dem = np.expand_dims(dem,axis=1) # expand the dimensions of dem to allow for broadcasting along vertical coordinate
     #Ensure that the heights variable is in ascending order, and flip density and cloud_mask if required.
-    dh = 0
     flipped = False
-    if (np.diff(heights)<0).any():
-        if (np.diff(heights)>=0).any(): # raise error if not ordered
-            msg = 'heights isnt ordered'
-            raise ValueError(msg)
+    order = _height_order(np.asarray(heights))
+    if order == 0: # raise error if not ordered
+        msg = 'heights isnt ordered'
+        raise ValueError(msg)
+    if order == -1:
         heights = np.flip(heights)
         density = np.flip(density,axis=1)
         cloud_mask = np.flip(cloud_mask,axis=1)
-        dh = np.mean(np.diff(heights))
         flipped = True
         print('Values flipped due to descending height order.')
+    dh = (heights[-1] - heights[0]) / (n_vert - 1) # the mean bin spacing
 
     if verbose: print(f'{heights[0]=}')
     dem_bin = np.floor_divide(dem - heights[0],dh).astype(int)
     if verbose: print(f'{dem_bin.dtype=}')
 
-    # reshape heights and dem to allow for "outer product" to be created
-    delta_heights = dem.reshape((n_prof,1)) - heights.reshape((1,n_vert))
+    # the bins within dem_tol bins of the dem bin are the window [lo, hi) that the ground is searched for in each profile
     if verbose: print(f'{(dem_tol*dh)=}')
-    delta_below = np.less_equal(delta_heights, dem+dem_tol*dh)
-    delta_above = np.greater_equal(delta_heights, dem-dem_tol*dh)
-    possible_ground = np.logical_and(delta_above,delta_below) # creates a mask of values +- dem_tol from the dem height
-    possible_ground = np.logical_and(possible_ground, cloud_mask)
+    lo = np.clip(dem_bin - dem_tol, 0, n_vert)
+    hi = np.clip(dem_bin + dem_tol + 1, 0, n_vert)
 
-    ground_identified = np.max(possible_ground, axis=1).astype(bool)
+    # take the lowest index where the bin has the maximum density of the cloudy bins that are within the dem tolerance.
+    ground_bin = dem_bin.copy() # if ground isn't found in signal, use dem height instead.
+    ground_identified = _ground_bin_loop(density, cloud_mask, lo, hi, ground_bin)
     if verbose: print(f'{np.max(ground_identified)=}')
     if verbose: print(f'{np.min(ground_identified)=}')
 
-    ground_bin = dem_bin.copy() # if ground isn't found in signal, use dem height instead.
-    ground_height = np.zeros_like(dem) * np.nan
-
-    for i,b in enumerate(ground_identified):
-        if b: # if ground has been identified in the profile
-            max_dens = np.max(density[i,possible_ground[i,:]])
-            g_bin = np.min(np.nonzero(density[i,:] == max_dens)[0]) # takes the lowest index where the bin has a density equal to the maximum density in the profile that is within the dem tolerance
-            ground_bin[i] = g_bin
-    
     if verbose: print('Ground bins found,')
     ground_height = ground_bin*dh + heights[0]
 
@@ -92,3 +84,39 @@ def get_ground_bin(density, cloud_mask, heights, dem, dem_tol, verbose=False):
     if verbose: print(f'{ground_bin.dtype=}')
     return ground_bin,ground_height
         
+
+
+
+@numba.njit(parallel=True, cache=True)
+def _ground_bin_loop(density, cloud_mask, lo, hi, ground_bin):
+    '''Function to find the ground bin in each profile with Numba JIT compilation, parallelised over the profiles.
+
+    Only the bins in the window [lo, hi) around the dem are scanned, and the first cloudy bin with the maximum density is taken as the ground.
+
+    INPUTS:
+        density : np.ndarray
+            nxm numpy array for the density field, with ascending heights.
+
+        cloud_mask : np.ndarray (dtype=boolean)
+            nxm numpy array for the cloud mask, with ascending heights.
+
+        lo, hi : np.ndarray (dtype=int)
+            (n,) numpy arrays of the first bin and one past the last bin of the window in each profile.
+
+        ground_bin : np.ndarray (dtype=int)
+            (n,) numpy array that the ground bins are written into for the profiles where the ground is identified.
+
+    OUTPUTS:
+        ground_identified : np.ndarray (dtype=boolean)
+            (n,) numpy array, True for the profiles where the ground has been identified.
+    '''
+    n_prof = density.shape[0]
+    ground_identified = np.zeros(n_prof, dtype=np.bool_)
+    for i in numba.prange(n_prof):
+        best = -np.inf
+        for j in range(lo[i], hi[i]):
+            if cloud_mask[i,j] and (density[i,j] > best or not ground_identified[i]):
+                best = density[i,j]
+                ground_bin[i] = j
+                ground_identified[i] = True
+    return ground_identified
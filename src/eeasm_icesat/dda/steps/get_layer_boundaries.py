@@ -7,13 +7,12 @@ The function to extract the layer height variables using the consolidated layer
 import numpy as np
 import numba
 
-#@numba.jit(nopython=True)
 def get_layer_boundaries(layer_mask, heights, n_layers=10, top_down=True, verbose=False):
     '''Function to extract the layer boundary heights using the consolidated layer_mask and the heights variable.
     
     The function can be performed from the top-down or bottom-up, which is given as an argument. NOTE: if top_down=False, then layer_bot and layer_top need to be swapped in the subsequent analysis
 
-    Numba has been implemented to speed up computation
+    Numba has been implemented to speed up computation, see _layer_boundaries_loop.
     
     INPUTS:
         layer_mask : np.ndarray (dtype=boolean)
@@ -43,18 +42,17 @@ def get_layer_boundaries(layer_mask, heights, n_layers=10, top_down=True, verbos
     '''
     if verbose: print('==== dda.steps.get_layer_boundaries()')
     (n_prof, n_vert) = layer_mask.shape
-    layer_bot = np.zeros((n_prof,n_layers)) *np.nan
-    layer_top = np.zeros_like(layer_bot) *np.nan
+    layer_bot = np.full((n_prof,n_layers), np.nan)
+    layer_top = np.full((n_prof,n_layers), np.nan)
     num_cloud_layers = np.zeros((n_prof,))
     
     # check heights is ordered. If not, raise an error
-    desc = False
-    if (np.diff(heights)<0).any():
-        if (np.diff(heights)>=0).any(): # raise error if not ordered
-            msg = 'heights isnt ordered'
-            raise ValueError(msg)
-        desc = True
-        if verbose: print('heights is in descending order.')
+    order = _height_order(np.asarray(heights))
+    if order == 0: # raise error if not ordered
+        msg = 'heights isnt ordered'
+        raise ValueError(msg)
+    desc = order == -1
+    if desc and verbose: print('heights is in descending order.')
         
     # correctly order heights and layer_mask for our analysis
     if (top_down and not desc) or (not top_down and desc):
@@ -63,14 +61,46 @@ def get_layer_boundaries(layer_mask, heights, n_layers=10, top_down=True, verbos
         print('layer_mask and heights flipped to account for desired direction of layer counting.')
 
     if verbose:print(f'{heights[0]=}  |  {heights[-1]=}')
-    # for each profile
-    for i, profile in enumerate(layer_mask):
+    _layer_boundaries_loop(layer_mask, heights, n_layers, layer_bot, layer_top, num_cloud_layers)
+
+    if not top_down:
+        layer_bot, layer_top = layer_top, layer_bot # swap the labelling of the variables as bottom_up counting will find cloud bottoms first rather than cloud tops.
+        if verbose: print(f'Swapped layer_bot and layer_top because {top_down=}.')
+    return num_cloud_layers, layer_bot, layer_top
+
+
+
+@numba.njit(parallel=True, cache=True)
+def _layer_boundaries_loop(layer_mask, heights, n_layers, layer_bot, layer_top, num_cloud_layers):
+    '''Function to assign the layer boundaries in each profile with Numba JIT compilation, parallelised over the profiles.
+
+    The layers are counted from the start of each profile, so layer_mask and heights must already be ordered in the desired direction of layer counting.
+
+    INPUTS:
+        layer_mask : np.ndarray (dtype=boolean)
+            nxm numpy array containing the consolidated cloud layer mask information.
+
+        heights : np.ndarray
+            (m,) numpy array of the vertical height coordinates associated with each pixel.
+
+        n_layers : int
+            The maximum number of cloud layers to keep track of.
+
+        layer_bot, layer_top : np.ndarray
+            (n,n_layers) numpy arrays of nans that the layer bottom and top heights are written into.
+
+        num_cloud_layers : np.ndarray
+            (n,) numpy array that the number of detected cloud layers in each profile is written into.
+    '''
+    (n_prof, n_vert) = layer_mask.shape
+    for i in numba.prange(n_prof):
         # iterate through the profile and assign layers
         inCloud = False
         layer_n = 0
-        for j, (b, h) in enumerate(zip(profile, heights)):
+        for j in range(n_vert):
+            b = layer_mask[i,j]
             if b and not inCloud:
-                layer_top[i,layer_n] = h
+                layer_top[i,layer_n] = heights[j]
                 inCloud = True
             elif not b and inCloud:
                 layer_bot[i,layer_n] = heights[j-1]
@@ -83,7 +113,23 @@ def get_layer_boundaries(layer_mask, heights, n_layers=10, top_down=True, verbos
             layer_n += 1
         num_cloud_layers[i] = layer_n
 
-    if not top_down:
-        layer_bot, layer_top = layer_top, layer_bot # swap the labelling of the variables as bottom_up counting will find cloud bottoms first rather than cloud tops.
-        if verbose: print(f'Swapped layer_bot and layer_top because {top_down=}.')
-    return num_cloud_layers, layer_bot, layer_top
+
+
+@numba.njit(cache=True)
+def _height_order(heights):
+    '''Function to determine the ordering of heights in a single pass, returning as soon as it is found to be unordered.
+
+    OUTPUTS:
+        order : int
+            -1 if heights is strictly descending, 1 if it is ascending (non-decreasing), and 0 if it is unordered.
+    '''
+    any_desc = False
+    any_asc = False
+    for i in range(1, heights.size):
+        if heights[i] < heights[i-1]:
+            any_desc = True
+        else:
+            any_asc = True
+        if any_desc and any_asc:
+            return 0
+    return -1 if any_desc else 1
@@ -5,6 +5,9 @@ Function to remove bins recognised as containing the ground signal from a mask.
 '''
 
 import numpy as np
+import numba
+
+from .get_layer_boundaries import _height_order
 
 def remove_ground_from_mask(layer_mask, ground_bin, cloud_mask, ground_width, heights, verbose=False):
     '''Function to remove the ground signal from a cloud_mask if the ground bins are present in layer_mask.
@@ -38,21 +41,48 @@ def remove_ground_from_mask(layer_mask, ground_bin, cloud_mask, ground_width, he
             nxm numpy array containing a mask denoting ground pixels (1s) and non-ground pixels (0s).
     '''
     if verbose: print('==== dda.steps.remove_ground_from_mask()')
-    cloud_mask_no_ground = cloud_mask.copy()
-    ground_mask = np.zeros_like(cloud_mask)
+    cloud_mask_no_ground = np.array(cloud_mask, dtype=bool) # copy, so that cloud_mask isn't modified
+    ground_mask = np.zeros(cloud_mask.shape, dtype=bool)
     # determine if the counting needs to be flipped
-    order = 1 # counting increments 
-    if (np.diff(heights)<0).any():
-        if (np.diff(heights)>=0).any(): # raise error if not ordered
-            msg = 'heights isnt ordered'
-            raise ValueError(msg)
-        order = -1 # counting decerements
-
-    for i,p in enumerate(layer_mask):
-        g_bin = ground_bin[i]
-        if ~np.isnan(g_bin): # if the ground signal has been detected
-            # remove the ground signal from cloud_mask
-            cloud_mask_no_ground[i,int(g_bin-ground_width):int(g_bin+ground_width+1)] = 0
-            ground_mask[i,int(g_bin-ground_width):int(g_bin+ground_width+1)] = cloud_mask[i,int(g_bin-ground_width):int(g_bin+ground_width+1)]
+    order = _height_order(np.asarray(heights)) # 1 if counting increments, -1 if counting decrements
+    if order == 0: # raise error if not ordered
+        msg = 'heights isnt ordered'
+        raise ValueError(msg)
+
+    # the ground signal is detected where ground_bin isn't nan
+    ground_bin = np.asarray(ground_bin, dtype=float)
+    detected = ~np.isnan(ground_bin)
+    g_bin = np.where(detected, ground_bin, 0).astype(np.int64)
+    _remove_ground_loop(g_bin, detected, ground_width, cloud_mask, cloud_mask_no_ground, ground_mask)
     
-    return cloud_mask_no_ground, ground_mask
\ No newline at end of file
+    return cloud_mask_no_ground, ground_mask
+
+
+@numba.njit(parallel=True, cache=True)
+def _remove_ground_loop(g_bin, detected, ground_width, cloud_mask, cloud_mask_no_ground, ground_mask):
+    '''Function to move the bins within ground_width of the ground bin from cloud_mask_no_ground to ground_mask, with Numba JIT compilation parallelised over the profiles.
+
+    The window of bins [g_bin-ground_width, g_bin+ground_width] is clipped to the extent of the profile.
+
+    INPUTS:
+        g_bin : np.ndarray (dtype=int)
+            (n,) numpy array of the ground bin in each profile.
+
+        detected : np.ndarray (dtype=bool)
+            (n,) numpy array, True for the profiles where the ground signal has been detected.
+
+        ground_width : int
+            see remove_ground_from_mask
+
+        cloud_mask : np.ndarray (dtype=bool)
+            nxm numpy array of the combined cloud mask.
+
+        cloud_mask_no_ground, ground_mask : np.ndarray (dtype=bool)
+            nxm numpy arrays that are modified in place, initially a copy of cloud_mask and zeros respectively.
+    '''
+    (n_prof, n_vert) = cloud_mask.shape
+    for i in numba.prange(n_prof):
+        if detected[i]:
+            for j in range(max(g_bin[i]-ground_width, 0), min(g_bin[i]+ground_width+1, n_vert)):
+                cloud_mask_no_ground[i,j] = False
+                ground_mask[i,j] = cloud_mask[i,j]
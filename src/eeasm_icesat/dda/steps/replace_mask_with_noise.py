@@ -5,8 +5,9 @@ Script contaiing the function to replcae values in the data array that are in th
 '''
 
 import numpy as np
+import numba
 
-def replace_mask_with_noise(data, mask, mean, sd, vmin=0, seed=None, verbose=False):
+def replace_mask_with_noise(data, mask, mean, sd, vmin=0, seed=None, out=None, inplace=False, verbose=False):
     '''Function to replace the values denoted by cloud_mask in data with normally distributed noise.
 
     INPUTS:
@@ -26,7 +27,13 @@ def replace_mask_with_noise(data, mask, mean, sd, vmin=0, seed=None, verbose=Fal
             Minimum value that the returned data will contain. This accounts for the fact that some noise values could fall below a physical threshold (i.e. 0).
 
         seed : None, int
-            Value used to initialise the scipy.stats.rv_continuous.random_state object. None will result in randomness on each run, whereas a provided number will seed the random algorithm.
+            Non-negative value used to seed the random generator, with profile i seeded by seed+i. None will result in randomness on each run, whereas a provided number will seed the random algorithm.
+
+        out : None, np.ndarray
+            (n,m) numpy array that data is copied into before the noise is written, to reuse an existing buffer. If None, a new array is allocated.
+
+        inplace : bool
+            If True, the noise is written directly into data, and no copy is made. out is then ignored.
 
         verbose : bool
             Flag for printing debug statements to the output log.
@@ -34,19 +41,44 @@ def replace_mask_with_noise(data, mask, mean, sd, vmin=0, seed=None, verbose=Fal
 
     OUTPUTS:
         data : np.ndarray
-            (n,m) numpy array, consisting of the data variable with some values replaced by noise.
+            (n,m) numpy array, consisting of the data variable with some values replaced by noise. This is data if inplace=True, or out if it is provided.
     '''
     if verbose:
         print('==== dda.steps.replace_mask_with_noise()')
         print(f'{seed=}')
 
-    noisy_data = data.copy()
-    (n_prof, n_vert) = noisy_data.shape
-    rs = (n_prof,1)
+    if inplace:
+        noisy_data = data
+    elif out is None:
+        noisy_data = data.copy()
+    else:
+        out[...] = data
+        noisy_data = out
+    _fill_noise(noisy_data, mask, mean, sd, vmin, -1 if seed is None else seed)
+
+    return noisy_data
 
-    noise = np.random.default_rng(seed).normal(loc=mean.reshape(rs), scale=sd.reshape(rs), size=noisy_data.shape)
-    noise[noise < vmin] = vmin
 
-    noisy_data[mask] = noise[mask]
+@numba.njit(parallel=True, cache=True)
+def _fill_noise(data, mask, mean, sd, vmin, seed):
+    '''Function to replace the masked values of data with normally distributed noise in place, with Numba JIT compilation parallelised over the profiles.
 
-    return noisy_data
\ No newline at end of file
+    If seed is non-negative, the random generator is seeded with seed+i before filling profile i, so that each profile is reproducible independently of the number of threads.
+
+    INPUTS:
+        data : np.ndarray
+            (n,m) numpy array, that the noise is written into.
+
+        mask, mean, sd, vmin : see replace_mask_with_noise
+
+        seed : int
+            The seed for the random generator, or -1 to not seed it.
+    '''
+    (n_prof, n_vert) = data.shape
+    for i in numba.prange(n_prof):
+        if seed >= 0:
+            np.random.seed(seed + i)
+        for j in range(n_vert):
+            if mask[i,j]:
+                v = mean[i] + sd[i]*np.random.normal()
+                data[i,j] = vmin if v < vmin else v # nan values (profiles without a noise estimate) are kept
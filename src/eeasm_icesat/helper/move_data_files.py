@@ -10,9 +10,10 @@ I'll also include code that can handle datetime selections of the data. That way
 import os
 import warnings
 import datetime
-import shutil
 import glob
 
+from .._utils.fs import fast_copy
+
 
 
 
@@ -107,5 +108,5 @@ def copy_file(initial,filename,endpoint):
             print(err)
             return False
     # the initial file and endpoint both exist.
-    shutil.copy(os.path.join(initial,filename),os.path.join(endpoint,filename))
+    fast_copy(os.path.join(initial,filename),os.path.join(endpoint,filename))
     return True
\ No newline at end of file
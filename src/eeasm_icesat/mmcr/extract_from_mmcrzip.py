@@ -6,6 +6,7 @@ Function to extract the MMCR MOM .nc.zip files within a /mmcrzip folder to .nc f
 
 import os
 import zipfile
+from .._utils.fs import iter_files
 
 def extract_from_mmcrzip(dir_target):
     '''Function to extract MMCR .n.zip files in dir_target/mmcrzip into dir_target
@@ -19,10 +20,9 @@ def extract_from_mmcrzip(dir_target):
             placeholder return
     '''
     # get all the .nc.zip files in dir_target/mmcrzip
-    files_zip = os.listdir(os.path.join(dir_target, 'mmcrzip'))
-    files_zip = [f for f in files_zip if f[-7:] == '.nc.zip']
+    files_zip = iter_files(os.path.join(dir_target, 'mmcrzip'), '.nc.zip')
 
-    files_unzip = os.listdir(dir_target)
+    files_unzip = set(iter_files(dir_target, '.nc'))
 
     for fname in files_zip:
         # for each .nc.zip file, check it hasn't already been unzipped to dir_target
@@ -30,11 +30,16 @@ def extract_from_mmcrzip(dir_target):
             continue
         # otherwise, unzip the file
         with zipfile.ZipFile(os.path.join(dir_target,'mmcrzip',fname), 'r') as zip_ref:
-            zip_ref.extractall(dir_target)
+            # only the .nc member is extracted, rather than any siblings in the archive
+            if fname[:-4] in zip_ref.namelist():
+                zip_ref.extract(fname[:-4], dir_target)
+            else:
+                zip_ref.extractall(dir_target)
         print(f'{fname} extracted')
 
     return None
 
+
 '''#example code'''
 #target = '/home/users/eeasm/_scripts/ICESat2/src/mmcr'
 #extract_from_mmcrzip(target)
\ No newline at end of file
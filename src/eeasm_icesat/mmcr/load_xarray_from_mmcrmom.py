@@ -8,41 +8,86 @@ import os
 import xarray as xr
 import numpy as np
 import netCDF4
+from .._utils.fs import list_files
 
-def load_xarray_from_mmcrmom(dir_target):
+def load_xarray_from_mmcrmom(dir_target, load=True, lazy=True):
     '''Function to load multiple MMCRMOM.nc files in dir_target into a singular xr.Dataset object.
 
+    The files are opened in parallel with xr.open_mfdataset, using dask. If a dask.distributed Client is active, it will be used to open the files.
+    If lazy=False, the files are instead read eagerly with netCDF4.MFDataset, see _load_with_mfdataset.
+
     INPUTS:
         dir_target : string
             the target directory that contains the data files.
 
+        load : bool
+            If True, the data is loaded into memory before being returned. If False, the dataset is returned lazily as dask arrays chunked along time.
+
+        lazy : bool
+            If True, the files are opened with xr.open_mfdataset. If False, they are read straight into memory with netCDF4.MFDataset, which avoids building the dask graph. load is then ignored.
+
     OUTPUTS:
         ds : xr.Dataset object
             The xr.Dataset object containing the radar data.
     '''
-    # list all the MMCRMom.nc files in the directory
-    files_mmcr = os.listdir(dir_target)
-    files_mmcr = [f for f in files_mmcr if f[-10:] == 'MMCRMom.nc']
+    # list all the MMCRMom.nc files in the directory, sorted so that they are concatenated in time order
+    files_mmcr = list_files(dir_target, 'MMCRMom.nc')
 
     print(f'Files being loaded: {files_mmcr}')
 
-    # list to hold the individual datasets before concatenation
-    datasets = []
-
-    for fname in files_mmcr:
-        data = xr.load_dataset(os.path.join(dir_target,fname))
-        datasets.append(data)
+    if not lazy:
+        return _load_with_mfdataset([os.path.join(dir_target,fname) for fname in files_mmcr])
 
-    ds = xr.concat(datasets,dim='time')
+    ds = xr.open_mfdataset([os.path.join(dir_target,fname) for fname in files_mmcr], combine='nested', concat_dim='time', parallel=True, chunks={'time':'auto'}, engine='netcdf4')
+    if load:
+        ds.load()
+        ds.close() # the data is in memory, so the files can be closed
     return ds
 
+
+def _load_with_mfdataset(files, aggdim='time', drop_variables=None):
+    '''Function to read multiple netCDF files into memory with netCDF4.MFDataset, concatenated along aggdim, and copy the variables into a new xr.Dataset.
+
+    NOTE: netCDF4.MFDataset can only read NETCDF3 or NETCDF4_CLASSIC format files, and aggdim must be the leftmost dimension of the aggregated variables in every file. Variables without aggdim are taken from the first file, rather than being concatenated along aggdim as in xr.open_mfdataset.
+
+    The raw values are read and then decoded with xr.decode_cf, so that the fill values, scaling and times are treated as in xr.open_mfdataset.
+
+    INPUTS:
+        files : list
+            list of full paths to the netCDF files, in the order that they are to be concatenated.
+
+        aggdim : string
+            the name of the dimension the files are concatenated along.
+
+        drop_variables : None, list
+            names of variables that aren't read from the files.
+
+    OUTPUTS:
+        ds : xr.Dataset object
+            The xr.Dataset object containing the data from all of the files, in memory.
+    '''
+    with netCDF4.MFDataset(files, aggdim=aggdim) as mf:
+        data_vars = {}
+        for name, var in mf.variables.items():
+            if drop_variables is not None and name in drop_variables:
+                continue
+            var.set_auto_maskandscale(False)
+            attrs = {k: getattr(var, k) for k in var.ncattrs()}
+            if name == aggdim and ' since ' in attrs.get('units', ''):
+                # the time units can differ between the files, so the times are converted to the units of the first file. MFTime requires a calendar, which defaults to the CF standard calendar if not given
+                var = netCDF4.MFTime(var, calendar=attrs.get('calendar', 'standard'))
+            data_vars[name] = (var.dimensions, var[:], attrs)
+        attrs = {k: mf.getncattr(k) for k in mf.ncattrs()}
+    return xr.decode_cf(xr.Dataset(data_vars, attrs=attrs))
+
+
 '''£example code
 target = '/home/users/eeasm/_scripts/ICESat2/src/mmcr'
 ds = load_xarray_from_mmcrmom(target)
 print(ds)
 '''
 
-def read_radar_data(dir_target, mode_idx=3, mask_sn=None): 
+def read_radar_data(dir_target, mode_idx=3, mask_sn=None, lazy=True): 
     '''Author: Sarah Barr
     Creation date: 18/1/23
 
@@ -55,15 +100,19 @@ def read_radar_data(dir_target, mode_idx=3, mask_sn=None):
             radar operational mode from which we want to select the data. This is 0-indexed, whereas the instrument modes range from 1-10. Thus, subtract one from the desired mode. *** CHECK THIS IS TRUE ***
         mask_sn : float, None
             If None, no masking will be performed, if a float, any reflectivity lower than mask_sn will be culled
+        lazy : bool : True
+            If True, the files are opened lazily with xr.open_mfdataset. If False, they are read into memory with netCDF4.MFDataset (see _load_with_mfdataset for the restrictions on the file format).
         
     '''
     #start_time = time.time()
-    files_mmcr = os.listdir(dir_target)
-    files_mmcr = [f for f in files_mmcr if f[-10:] == 'MMCRMom.nc']
-    files_mmcr = [os.path.join(dir_target,f) for f in files_mmcr]
-    files_mmcr = sorted(files_mmcr)
-
-    mmcr_data = xr.open_mfdataset(files_mmcr,concat_dim = 'time', combine = 'nested')#,drop_variables='heights')
+    files_mmcr = [os.path.join(dir_target,f) for f in list_files(dir_target, 'MMCRMom.nc')]
+
+    # the files are all netCDF, so the engine is given explicitly to avoid xarray reading the start of every file to guess it
+    # the masking and scaling is applied once after the mode selection, rather than to every file. The times are still decoded per file, as their units can differ between files.
+    if lazy:
+        mmcr_data = xr.open_mfdataset(files_mmcr,concat_dim = 'time', combine = 'nested', engine='netcdf4', parallel=True, mask_and_scale=False, decode_coords=False, drop_variables=['heights'])
+    else:
+        mmcr_data = _load_with_mfdataset(files_mmcr, drop_variables=['heights'])
     
     # testing the laoding of the netcdf
     #mmcr_data = xr.open_dataset(files_mmcr[0])
@@ -74,12 +123,24 @@ def read_radar_data(dir_target, mode_idx=3, mask_sn=None):
     
     # select data from chosen mode
     mmcr_data = mmcr_data.sel(mode = mode_idx,drop=True)
+    if lazy:
+        mmcr_data = xr.decode_cf(mmcr_data, decode_times=False)
     #mmcr_data = mmcr_data.where(mmcr_data.ModeNum==mode_idx)#, drop = True)
     
+    mmcr_data = _mask_radar_data(mmcr_data, mask_sn)
+        
+    #print("--- %s seconds ---" % (time.time() - start_time))
+    return mmcr_data
 
-    heights = mmcr_data.Heights
+
+def _mask_radar_data(mmcr_data, mask_sn):
+    '''Function to assign the masked Heights coordinate and mask the data on the signal to noise ratio, for the radar data of a single mode. See read_radar_data.'''
+    # the heights are loaded once, so that the Heights coordinate is built from in-memory values rather than a chain of dask operations
+    heights = mmcr_data.Heights.load()
     heights = heights.where(heights < 1e30)
-    heights.interpolate_na(dim='heights',fill_value='extrapolate')
+    # the heights are only interpolated if any of the fill values have been masked
+    if bool(heights.isnull().any()):
+        heights = heights.interpolate_na(dim='heights',fill_value='extrapolate')
 
     mmcr_data = mmcr_data.assign_coords(Heights=heights)
     #mmcr_data = mmcr_data.assign_coords(time =mmcr_data.time_offset)
@@ -87,6 +148,47 @@ def read_radar_data(dir_target, mode_idx=3, mask_sn=None):
     if mask_sn is not None:
         mmcr_data = mmcr_data.where(mmcr_data.SignalToNoiseRatio> mask_sn)
     mmcr_data = mmcr_data.where(mmcr_data.SignalToNoiseRatio < 1e36)
-        
-    #print("--- %s seconds ---" % (time.time() - start_time))
-    return mmcr_data
\ No newline at end of file
+    return mmcr_data
+
+
+def read_radar_data_mpi(dir_target, mode_idx=3, mask_sn=None, comm=None):
+    '''Function to read the MMCR Moment files within a directory across the ranks of an MPI communicator, for use on HPC systems such as JASMIN. See read_radar_data.
+
+    The sorted files are split into contiguous blocks, one per rank. Each rank reads its block and selects mode_idx, so only the selected mode is communicated. The blocks are then gathered onto every rank and concatenated in time order.
+    Requires mpi4py, and should be run under mpirun with every rank calling the function. Each rank opens its block with xr.open_mfdataset, so dask is also required.
+
+    INPUTS:
+        dir_target, mode_idx, mask_sn : see read_radar_data
+
+        comm : None, mpi4py.MPI.Comm
+            The communicator the files are shared across. If None, MPI.COMM_WORLD is used.
+
+    OUTPUTS:
+        mmcr_data : xr.Dataset object
+            The xr.Dataset containing the radar data for the selected mode, in memory on every rank.
+    '''
+    if comm is None:
+        try:
+            from mpi4py import MPI
+        except ImportError:
+            print('read_radar_data_mpi: mpi4py is required to read the files across MPI ranks')
+            raise
+        comm = MPI.COMM_WORLD
+
+    files_mmcr = [os.path.join(dir_target,f) for f in list_files(dir_target, 'MMCRMom.nc')]
+    # every rank lists the same directory, so they all raise together rather than leaving the others waiting in allgather
+    if len(files_mmcr) == 0:
+        msg = f'read_radar_data_mpi: no MMCRMom.nc files found in {dir_target=}'
+        raise FileNotFoundError(msg)
+    files_local = np.array_split(np.array(files_mmcr, dtype=object), comm.Get_size())[comm.Get_rank()]
+
+    mmcr_local = None
+    if len(files_local) > 0:
+        with xr.open_mfdataset(list(files_local), concat_dim='time', combine='nested', engine='netcdf4', drop_variables=['heights']) as ds:
+            mmcr_local = ds.sel(mode=mode_idx, drop=True).load()
+
+    # the blocks are gathered in rank order, which is the time order of the files. As there is at least one file, at least one of the blocks is non-empty
+    blocks = [ds for ds in comm.allgather(mmcr_local) if ds is not None]
+    mmcr_data = xr.concat(blocks, dim='time', data_vars='all') if len(blocks) > 1 else blocks[0]
+
+    return _mask_radar_data(mmcr_data, mask_sn)
\ No newline at end of file
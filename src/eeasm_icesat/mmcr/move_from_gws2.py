@@ -6,10 +6,11 @@ Function to move MOM MMCR files from the ICECAPSarchive on JASMIN to a target di
 import datetime as pydt
 import os
 import warnings
-import shutil
+from .._utils.fs import iter_files, copy_files
+from .._utils.dt import remove_minute_from_datetime
 
 
-def move_from_gws2(dir_target, dir_mmcr='/gws/nopw/j04/ncas_radar_vol2/data/ICECAPSarchive/mmcr/mom',date_range=None,filenames_list=None):
+def move_from_gws2(dir_target, dir_mmcr='/gws/nopw/j04/ncas_radar_vol2/data/ICECAPSarchive/mmcr/mom',date_range=None,filenames_list=None,n_threads=16):
     '''Function to move MMCR MOM (raw) files from the ICECAPS archive to a target directory.
 
     The function will select files based on the date range that they fall in or based on direct matches to desired files. This means that date_range will take precedence over filenames_list if both are not None.
@@ -30,6 +31,9 @@ def move_from_gws2(dir_target, dir_mmcr='/gws/nopw/j04/ncas_radar_vol2/data/ICEC
 
         filenames_list : None, iterable of strings
             List of filenames for which there must be a direct match in the archive (including file extension).
+
+        n_threads : int
+            The number of threads used to copy the files, as the copies from the archive are latency bound. 1 copies the files sequentially.
     '''
     # either date_range or filenames_list must be not None
     if date_range is None and filenames_list is None:
@@ -52,40 +56,36 @@ def move_from_gws2(dir_target, dir_mmcr='/gws/nopw/j04/ncas_radar_vol2/data/ICEC
         date_init = date_range[0]
         date_end = date_range[1]
         # need to round to the hour: down for date_init; up for date_end
-        date_init = _remove_minute_from_datetime(date_init)
-        date_end = _remove_minute_from_datetime(date_end) + dt_hour
+        date_init = remove_minute_from_datetime(date_init)
+        date_end = remove_minute_from_datetime(date_end) + dt_hour
 
+        filenames = []
         currentDate = date_init
         while currentDate <= date_end:
             # for each datetime in the range, we need to create the expected filename and see if its in the directory
-            current_filename = currentDate.strftime(mmcr_filename_format)
-            exists_archive = os.path.exists(os.path.join(dir_mmcr,current_filename))
-            exists_destination = os.path.exists(os.path.join(dir_target,current_filename))
+            filenames.append(currentDate.strftime(mmcr_filename_format))
+            currentDate = currentDate + dt_hour
+    else:
+        # otherwise, filenames_list has been provided. Duplicates are removed, keeping the order.
+        filenames = list(dict.fromkeys(filenames_list))
 
-            print(f'{current_filename} | {exists_archive=} | {exists_destination=}')
-            shutil.copy(os.path.join(dir_mmcr,current_filename),os.path.join(dir_target,current_filename))
+    # list the directories once, rather than checking for each file individually
+    files_archive = set(iter_files(dir_mmcr))
+    files_destination = set(iter_files(dir_target))
 
-            currentDate = currentDate + dt_hour
-        return
+    # the files to copy are collected, and then copied together
+    paths_copy = []
+    for current_filename in filenames:
+        exists_archive = current_filename in files_archive
+        exists_destination = current_filename in files_destination
 
-    # otherwise, filenames_list has been provided
-    raise NotImplementedError
+        print(f'{current_filename} | {exists_archive=} | {exists_destination=}')
+        if exists_archive and not exists_destination:
+            paths_copy.append((os.path.join(dir_mmcr,current_filename),os.path.join(dir_target,current_filename)))
 
+    copy_files(paths_copy, n_threads)
+    return
 
-def _remove_minute_from_datetime(dtObj):
-    '''Function to remove the minute (and finer) component(s) from a datetime object.
-    
-    INPUTS:
-        dtObj : pydt.datetime object
-            The datetime object for which we want to remove the minute component (round down).
-            
-    OUTPUTS:
-        dtObj_ : pydt.datetime object
-            The datetime object with the minute and finer components removed.
-    '''
-    d_hour_string = f'{dtObj.year:04}-{dtObj.month:02}-{dtObj.day:02}T{dtObj.hour:02}:00:00'
-    dtObj_ = pydt.datetime.fromisoformat(d_hour_string)
-    return dtObj_
 
 '''
 #Example code
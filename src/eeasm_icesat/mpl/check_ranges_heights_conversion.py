@@ -10,22 +10,59 @@ Script to generate data for the linear relation between the ranges_ and height v
 
 import numpy as np
 import xarray as xr
-import datetime
-import struct
 import os
 
 from get_mpl_from_archive import get_mpl_from_archive
 
 # main process
 
+def calc_linear_fit(ranges_, heights):
+    '''Function to calculate the daily mean and standard deviation of the slope and offset of the linear height~ranges_ relation, fitted separately for each profile.
+
+    The least squares fit for every profile is calculated at once with the closed form, m = cov(ranges_, heights)/var(ranges_), c = mean(heights) - m*mean(ranges_).
+
+    INPUTS:
+        ranges_ : np.ndarray
+            (n,m) numpy array of the ranges_ values for the n profiles over the day.
+
+        heights : np.ndarray
+            (n,m) or (m,) numpy array of the heights corresponding to ranges_.
+
+    OUTPUTS:
+        m : float64
+            The daily mean slope of the height~ranges_ relation.
+
+        c : float64
+            The daily mean offset for the linear height~ranges_ relation.
+
+        sdm : float64
+            The standard deviation for the m values over the day
+
+        sdc : float64
+            The standard deviation for the c values over the day
+    '''
+    X = np.asarray(ranges_, dtype=np.float64)
+    Y = np.broadcast_to(np.asarray(heights, dtype=np.float64), X.shape)
+    X_mean = X.mean(axis=1)
+    Y_mean = Y.mean(axis=1)
+    m_profiles = ((X*Y).mean(axis=1) - X_mean*Y_mean) / X.var(axis=1)
+    c_profiles = Y_mean - m_profiles*X_mean
+    return m_profiles.mean(), c_profiles.mean(), m_profiles.std(), c_profiles.std()
+
+
+# record format of the binary file: little endian, five 8-byte "double"s per day
+_REC_DTYPE = np.dtype([('t','<f8'),('m','<f8'),('c','<f8'),('sdm','<f8'),('sdc','<f8')])
+
 def write_to_binary(fname, dto, m, c, sdm, sdc):
     '''Function to write the datetime, m and c values to a binary file.
+
+    The inputs can be scalars for a single day, or arrays to write the records for multiple days at once.
     
     INPUTS:
         fname : string
             The full filename of the binary file to be written to
             
-        dto : numpy.datetime64
+        dto : numpy.datetime64, np.ndarray (dtype=np.datetime64)
             The datetime64 object for the start of the day. Can be written in as a 64-bit object to the buffer
 
         m : float64
@@ -39,20 +76,57 @@ def write_to_binary(fname, dto, m, c, sdm, sdc):
 
         sdc: The standard deviation for the c values of the day
     '''
-    # convert numpy datatypes to python data types
-    dto = dto.astype('float').item()
-    m = m.item()
-    c = c.item()
-    sdm = sdm.item()
-    sdc = sdc.item()
+    dto = np.atleast_1d(dto)
+    records = np.empty(dto.shape, dtype=_REC_DTYPE)
+    records['t'] = dto.astype('float')
+    records['m'] = m
+    records['c'] = c
+    records['sdm'] = sdm
+    records['sdc'] = sdc
+
+    write_many_to_binary(fname, records)
+
+
+def write_many_to_binary(fname, records):
+    '''Function to append multiple records to a binary file, with a single open and write.
+
+    INPUTS:
+        fname : string
+            The full filename of the binary file to be written to
+
+        records : iterable, np.ndarray
+            Iterable of (dto, m, c, sdm, sdc) tuples, one for each day (see write_to_binary), or a numpy structured array with dtype _REC_DTYPE.
+    '''
+    if not isinstance(records, np.ndarray):
+        records = list(records)
+        arr = np.empty(len(records), dtype=_REC_DTYPE)
+        for name, values in zip(_REC_DTYPE.names, zip(*records)):
+            arr[name] = np.asarray(values).astype('float')
+        records = arr
 
     with open(fname, 'ab') as f:
-        # format for the binary writing.
-        # little endian, three 8-byte segments for "double"s
-        fmt = '<ddddd'
-        size = struct.calcsize(fmt)
-        bts = struct.pack(fmt,dto,m,c,sdm,sdc)
-        f.write(bts)
+        f.write(records.astype(_REC_DTYPE, copy=False).tobytes())
+
+
+def memmap_binary(fname, n_records=None):
+    '''Function to memory map the binary file, so that the records for many days can be written or updated in place without opening the file for each day.
+
+    Records are written with mm[i] = (dto.astype('float'), m, c, sdm, sdc), in the same format as write_to_binary. The changes are written to the file when the memmap is flushed or deleted.
+
+    INPUTS:
+        fname : string
+            The full filename of the binary file
+
+        n_records : None, int
+            If an int, the file is created (or overwritten) with space for n_records records, e.g. one for each day to be processed. If None, the existing file is opened to be read and updated.
+
+    OUTPUTS:
+        mm : np.memmap
+            memory mapped structured array with dtype _REC_DTYPE.
+    '''
+    if n_records is None:
+        return np.memmap(fname, dtype=_REC_DTYPE, mode='r+')
+    return np.memmap(fname, dtype=_REC_DTYPE, mode='w+', shape=(n_records,))
 
 
 def read_from_binary(fname):
@@ -78,30 +152,15 @@ def read_from_binary(fname):
         sdc : np.ndarray : dtype=float64
             array containing the standard deviation on c values.
     '''
-    times = []
-    m = []
-    c = []
-    sdm = []
-    sdc = []
-
-    with open(fname, 'rb') as f:
-        fmt = '<ddddd'
-        size = struct.calcsize(fmt)
-        # keep reading the file when the buffer is the right size
-        while (buff := f.read(size)):
-            vals = struct.unpack(fmt,buff)
-            times.append(
-            np.datetime64(datetime.datetime.utcfromtimestamp(vals[0])))
-            m.append(vals[1])
-            c.append(vals[2])
-            sdm.append(vals[3])
-            sdc.append(vals[4])
-    
-    times = np.array(times, dtype=np.datetime64)
-    m = np.array(m, dtype=np.float64)
-    c = np.array(c, dtype=np.float64)
-    sdm = np.array(sdm, dtype=np.float64)
-    sdc = np.array(sdc, dtype=np.float64)
+    # read all of the records at once
+    records = np.fromfile(fname, dtype=_REC_DTYPE)
+
+    # the times are stored as seconds since the epoch, and are read to microsecond precision
+    times = np.round(records['t']*1e6).astype(np.int64).astype('datetime64[us]')
+    m = records['m']
+    c = records['c']
+    sdm = records['sdm']
+    sdc = records['sdc']
     return times, m, c, sdm, sdc
 
 
@@ -126,8 +185,7 @@ def _test_read_write():
 
     data = _synthetic_data()
     filename = '/home/users/eeasm/_scripts/ICESat2/src/mpl/range_height.bin'
-    for t,m,c,sdm,sdc in zip(*data):
-        write_to_binary(filename, t, m, c, sdm, sdc)
+    write_many_to_binary(filename, zip(*data))
     print('Data written!!')
 
     data_out = read_from_binary(filename)
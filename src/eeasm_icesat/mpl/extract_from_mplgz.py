@@ -4,18 +4,29 @@ Creation date: 24/01/2023
 Function to extract the .mpl.gz files from dir_target/mplraw_zip to dir_target/mplraw
 '''
 
-import gzip
+try:
+    from isal import igzip as gzip # drop-in replacement for gzip using the ISA-L accelerated inflate, if installed
+except ImportError:
+    import gzip
 import os
 import shutil
 import warnings
+from concurrent.futures import ProcessPoolExecutor
+from eeasm_icesat._utils.fs import cached_files
 
-def extract_from_mplgz(dir_target, verbose=False):
+def extract_from_mplgz(dir_target, n_jobs=-1, index=None, verbose=False):
     '''Function to extract the .mpl.gz files from dir_target/mplraw_zip into dir_target/mpl_raw
     
     INPUTS:
         dir_target : string
             Target directory that contains the /mplraw_zip folder containing .mpl.gz files.
 
+        n_jobs : int
+            The number of worker processes used to decompress the files. -1 uses all available cores, and 1 extracts the files sequentially in the current process.
+
+        index : None, dict
+            dictionary of cached directory listings shared between the stages of get_mpl_from_archive, see _utils.fs.cached_files. If None, the directories are scanned.
+
         verbose : boolean
             if True, long formatted string is printed for each file. Otherwise, 1 is printed for extracting, 0 for already extracted.
     '''
@@ -27,34 +38,65 @@ def extract_from_mplgz(dir_target, verbose=False):
         warnings.warn(f'extract_from_mplgz: /mplraw does not exist at {dir_target=}. Creating subdirectory now.')
         os.mkdir(dir_unzip)
 
-    files_mpl = os.listdir(dir_zip)
-    files_mpl = [f for f in files_mpl if f[-7:] == '.mpl.gz']
+    files_mpl = (f for f in cached_files(dir_zip, index) if f.endswith('.mpl.gz'))
 
-    files_unzip = os.listdir(dir_unzip)
+    files_unzip = cached_files(dir_unzip, index)
 
     if verbose: print('extract_from_mplgz: ')
     else: print(f'{"extract_from_mplgz":>20}: ', end='')
 
+    # the already extracted files are skipped before the extractions are distributed
+    files_todo = []
     for fname in files_mpl:
         if fname[:-3] in files_unzip:
             # if the file has already been extracted, pass
             if verbose: print(f'{fname} : already extracted')
             else: print('0', end='')
             continue
-        
-        if verbose: print(f'{fname} : extracting')
+        files_todo.append(fname)
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    n_jobs = max(1, min(n_jobs, len(files_todo)))
+
+    paths_todo = [(os.path.join(dir_zip,fname), os.path.join(dir_unzip, fname[:-3])) for fname in files_todo]
+    def report(fname):
+        files_unzip.add(fname[:-3])
+        if verbose: print(f'{fname} : extracted')
         else: print('1', end='')
-        
-        # solution taken from https://stackoverflow.com/questions/31028815/how-to-unzip-gz-file-using-python
-        # Matt & Erick 's solutions
-        with gzip.open(os.path.join(dir_zip,fname), 'rb') as f_in:
-            with open(os.path.join(dir_unzip, fname[:-3]), 'wb') as f_out:
-                shutil.copyfileobj(f_in,f_out)
+
+    if n_jobs == 1:
+        for fname, paths in zip(files_todo, paths_todo):
+            _extract_gz(paths)
+            report(fname)
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            # the files are reported in order, as their extractions complete
+            for fname, _ in zip(files_todo, executor.map(_extract_gz, paths_todo, chunksize=max(1, len(paths_todo)//(4*n_jobs)))):
+                report(fname)
 
     if verbose: print('extract_from_mplgz complete.')
     else: print('')
     return None
 
+
+def _extract_gz(paths):
+    '''Function to decompress a single .gz file.
+
+    The compressed file is read through a 1MB buffer, and the decompressed data is copied in 4MB blocks, to reduce the number of reads and writes.
+
+    INPUTS:
+        paths : tuple
+            (fname_gz, fname_out) tuple of the full filenames of the .gz file and the decompressed file to be written.
+    '''
+    fname_gz, fname_out = paths
+    # solution taken from https://stackoverflow.com/questions/31028815/how-to-unzip-gz-file-using-python
+    # Matt & Erick 's solutions
+    with open(fname_gz, 'rb', buffering=1<<20) as f_raw, gzip.GzipFile(fileobj=f_raw, mode='rb') as f_in:
+        with open(fname_out, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out, 4<<20)
+
+
 '''
 # example code
 target = '/home/users/eeasm/_scripts/ICESat2/src/mpl'
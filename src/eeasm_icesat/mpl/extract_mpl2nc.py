@@ -6,22 +6,37 @@ Function to utilise the mpl2nc package in the command line to turn the .mpl file
 
 import os
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 import mpl2nc
+from eeasm_icesat.mpl.load_mpl_inline import mpl2nc_read_mpl_gzip, process_nrb
+from eeasm_icesat._utils.fs import cached_files
 
-def extract_mpl2nc(dir_target, verbose=False):
+def extract_mpl2nc(dir_target, n_jobs=-1, from_gz=False, index=None, verbose=False):
     '''Function to extract .mpl files in dir_target/mplraw to .nc files in dir_target/mpl using the mpl2nc package.
     
     In its initial implementation, I'm not going to have any calibration for afterpulse, deadtime correction or overlap correction. Given I can access the functions directly, I shouldn't have to load in binary afterpulse files, I could just pass the data loaded from .nc files created using mpl2nc anyway...
 
+    If from_gz=True, the .mpl.gz files in dir_target/mplraw_zip are instead read directly (as in load_mpl_inline), so that extract_from_mplgz doesn't need to write the intermediate .mpl files.
+
     INPUTS:
         dir_target : string
             directory in which the data analysis is being performed. Should contain a subdirectory dir_target/mplraw containing .mpl files.
 
+        n_jobs : int
+            The number of worker processes used to convert the files. -1 uses all available cores, and 1 converts the files sequentially in the current process.
+
+        from_gz : boolean
+            if True, the .mpl.gz files in dir_target/mplraw_zip are converted. Otherwise, the .mpl files in dir_target/mplraw are converted.
+
+        index : None, dict
+            dictionary of cached directory listings shared between the stages of get_mpl_from_archive, see _utils.fs.cached_files. If None, the directories are scanned.
+
         verbose : boolean
             if True, prints a long formatted string for each file. Else, prints 0 for already converted files, 1 for files being converted.
     '''
 
-    dir_bin = os.path.join(dir_target, 'mplraw')
+    dir_bin = os.path.join(dir_target, 'mplraw_zip' if from_gz else 'mplraw')
+    ext = '.mpl.gz' if from_gz else '.mpl'
     dir_nc = os.path.join(dir_target, 'mpl')
 
     # create the dir_target/mpl folder if it doesn't already exist
@@ -29,34 +44,74 @@ def extract_mpl2nc(dir_target, verbose=False):
         warnings.warn(f'extract_mpl2nc: /mpl does not exist at {dir_target=}. Creating subdirectory now.')
         os.mkdir(dir_nc)
 
-    files_mpl = os.listdir(dir_bin)
-    files_mpl = [f for f in files_mpl if f[-4:] == '.mpl']
+    files_mpl = (f for f in cached_files(dir_bin, index) if f.endswith(ext))
 
-    files_unzip = os.listdir(dir_nc)
+    files_unzip = cached_files(dir_nc, index)
 
     if verbose: print('extract_mpl2nc:')
     else: print(f'{"extract_mpl2nc":>20}: ', end='')
 
+    # the already converted files are skipped before the conversions are distributed
+    files_todo = []
     for fname in files_mpl:
-        if (fname[:-3] + '.nc') in files_unzip:
+        if any(name in files_unzip for name in _nc_names(fname, ext)):
             # if the file has already been extracted, pass
             if verbose: print(f'{fname} : already converted')
             else: print('0', end='')
             continue
-        
-        # taken from mpl2nc.main path for individual files
-        mpl = mpl2nc.read_mpl( os.path.join(dir_bin,fname) )
-        mpl = mpl2nc.process_nrb(mpl)
-        mpl2nc.write(mpl, os.path.join(dir_nc, (fname[:-3] + '.nc')) )
+        files_todo.append(fname)
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    n_jobs = max(1, min(n_jobs, len(files_todo)))
+
+    paths_todo = [(os.path.join(dir_bin,fname), os.path.join(dir_nc, _nc_names(fname, ext)[0])) for fname in files_todo]
+    def report(fname):
+        files_unzip.add(_nc_names(fname, ext)[0])
         if verbose: print(f'{fname} : converted')
         else: print('1', end='')
 
+    if n_jobs == 1:
+        for fname, paths in zip(files_todo, paths_todo):
+            _convert_mpl(paths)
+            report(fname)
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            # the files are reported in order, as their conversions complete
+            for fname, _ in zip(files_todo, executor.map(_convert_mpl, paths_todo, chunksize=max(1, len(paths_todo)//(4*n_jobs)))):
+                report(fname)
+
     if verbose: print('extract_mpl2nc complete.')
     else: print('')
 
     return None
 
 
+def _nc_names(fname, ext):
+    '''Function to return the names of the .nc file for the .mpl or .mpl.gz file fname with extension ext.
+
+    The first name is the one written: as for the .mpl files since the initial implementation, the .nc file for YYYYmmddHHMM.mpl is YYYYmmddHHMM..nc, so the .mpl and .mpl.gz paths write the same name and existing converted files are recognised. The second name (YYYYmmddHHMM.nc) is also accepted as already converted.
+    '''
+    stem = fname[:-len(ext)]
+    return (stem + '..nc', stem + '.nc')
+
+
+def _convert_mpl(paths):
+    '''Function to convert a single .mpl (or .mpl.gz) file to a .nc file, taken from the mpl2nc.main path for individual files.
+
+    INPUTS:
+        paths : tuple
+            (fname_mpl, fname_nc) tuple of the full filenames of the .mpl or .mpl.gz file to be converted and the .nc file to be written.
+    '''
+    fname_mpl, fname_nc = paths
+    if fname_mpl.endswith('.gz'):
+        mpl = mpl2nc_read_mpl_gzip(fname_mpl)
+    else:
+        mpl = mpl2nc.read_mpl(fname_mpl)
+    mpl = process_nrb(mpl)
+    mpl2nc.write(mpl, fname_nc)
+
+
 '''
 # example code
 target = '/home/users/eeasm/_scripts/ICESat2/src/mpl'
@@ -4,13 +4,14 @@ Creation date: 27/1/23
 Function to get the mpl data from an archive position and then extract the files int the target directory.
 
 This is a simple combineation of move_mplraw, extract_mplgz and extract_mpl2nc.
+By default, the .mpl.gz files are converted directly by extract_mpl2nc, without extract_mplgz writing the intermediate .mpl files.
 '''
 import datetime
 from move_mplraw import move_mplraw
 from extract_from_mplgz import extract_from_mplgz
 from extract_mpl2nc import extract_mpl2nc
 
-def get_mpl_from_archive(dir_target, dir_mpl='/gws/nopw/j04/ncas_radar_vol2/data/ICECAPSarchive/mpl/raw', date_range=None, date=None, filenames_list=None, verbose=False):
+def get_mpl_from_archive(dir_target, dir_mpl='/gws/nopw/j04/ncas_radar_vol2/data/ICECAPSarchive/mpl/raw', date_range=None, date=None, filenames_list=None, keep_mplraw=False, verbose=False):
     '''Function to get and extract raw mpl archived files.
     
     INPUTS:
@@ -29,16 +30,22 @@ def get_mpl_from_archive(dir_target, dir_mpl='/gws/nopw/j04/ncas_radar_vol2/data
         filenames_list : None, iterable of strings
             Iterable of strings that will serve as the filenames to be copied - must be exact matches including file extensions.
 
+        keep_mplraw : boolean
+            if True, the .mpl.gz files are extracted into dir_target/mplraw before being converted. Otherwise, the .mpl.gz files are converted directly.
+
         verbose : boolean
             if True, status for each file will be printed. If False, this will be in a compressed, single-line format
     '''
-    print(f'get_mpl_from_archive({dir_target=}, {dir_mpl=}, {date_range=}, {date=}, {filenames_list=}, {verbose=})')
+    print(f'get_mpl_from_archive({dir_target=}, {dir_mpl=}, {date_range=}, {date=}, {filenames_list=}, {keep_mplraw=}, {verbose=})')
 
     if date is not None:
         d_init = datetime.datetime(year=date.year, month=date.month, day=date.day, hour=0, minute=0, second=0)
         d_end = datetime.datetime(year=date.year, month=date.month, day=date.day, hour=23, minute=59, second=59)
         date_range = [d_init, d_end]
     
-    move_mplraw(dir_target=dir_target, dir_mpl=dir_mpl, date_range=date_range, filenames_list=filenames_list, verbose=verbose)
-    extract_from_mplgz(dir_target=dir_target, verbose=verbose)
-    extract_mpl2nc(dir_target=dir_target, verbose=verbose)
\ No newline at end of file
+    # the directory listings are shared between the stages, so that each directory is only scanned once
+    index = {}
+    move_mplraw(dir_target=dir_target, dir_mpl=dir_mpl, date_range=date_range, filenames_list=filenames_list, index=index, verbose=verbose)
+    if keep_mplraw:
+        extract_from_mplgz(dir_target=dir_target, index=index, verbose=verbose)
+    extract_mpl2nc(dir_target=dir_target, from_gz=not keep_mplraw, index=index, verbose=verbose)
\ No newline at end of file
@@ -5,15 +5,22 @@ Script to allow for the loading of .mpl.gz files without having to explicitly un
 '''
 
 import mpl2nc
-import gzip
+try:
+    from isal import igzip as gzip # drop-in replacement for gzip using the ISA-L accelerated inflate, if installed
+except ImportError:
+    import gzip
+import io
 import os
+import pickle
+import hashlib
+import functools
 import datetime
 import xarray as xr
 import numpy as np
-import netCDF4
 import glob
+from concurrent.futures import ProcessPoolExecutor
 
-def load_mpl_inline(fname):
+def load_mpl_inline(fname, cache_dir=None):
     '''Function to load .mpl.gz files from the archive without the need to create additional files.
     
     This will work by opening the .gz file in a binary read mode, and then using functions from mpl2nc to read the binary format.
@@ -24,27 +31,109 @@ def load_mpl_inline(fname):
         fname : string
             Full filename of the .mpl.gz file to be opened, including the file extension.
 
+        cache_dir : None, string
+            directory in which the processed mpl dictionaries are cached, see _read_process_mpl_gzip. If None, the file is always read.
+
     OUTPUTS:
         ds : xr.Dataset
             The loaded mpl data as an xarray dataset, which can be accepted by raw_to_ingested.py
     '''
-    # same method as extract_mpl2nc, except utilising gzip.open().
-    mpl = mpl2nc_read_mpl_gzip(fname)
-    mpl = mpl2nc.process_nrb(mpl)
+    mpl = _read_process_mpl_gzip(fname, cache_dir)
     # convert mpl to xr.Dataset format
     ds = mpl_dict_to_xarray(mpl)
     return ds
 
 
+def _read_process_mpl_gzip(fname, cache_dir=None):
+    '''Function to read and process a single .mpl.gz file into the mpl2nc mpl dictionary. This is the work done in the worker processes of mf_load_mpl_inline, so that only the dictionary of numpy arrays is sent back.
+
+    If cache_dir is given, the processed dictionary is pickled into cache_dir, keyed by the path, modification time and size of the .mpl.gz file, so that an unchanged file is only read and processed once.
+    '''
+    if cache_dir is not None:
+        st = os.stat(fname)
+        key = hashlib.sha1(str((os.path.abspath(fname), st.st_mtime_ns, st.st_size)).encode()).hexdigest()
+        fname_cache = os.path.join(cache_dir, f'{os.path.basename(fname)}.{key}.pkl')
+        if os.path.isfile(fname_cache):
+            with open(fname_cache, 'rb') as f:
+                return pickle.load(f)
+
+    # same method as extract_mpl2nc, except utilising gzip.open().
+    mpl = mpl2nc_read_mpl_gzip(fname)
+    mpl = process_nrb(mpl)
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # written to a temporary file first, so that an interrupted write is not read as a valid cache
+        fname_tmp = f'{fname_cache}.{os.getpid()}.tmp'
+        with open(fname_tmp, 'wb') as f:
+            pickle.dump(mpl, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(fname_tmp, fname_cache)
+    return mpl
+
+
+def process_nrb(d):
+    '''Vectorised rewriting of mpl2nc.process_nrb, calculating the normalised relative backscatter for all of the profiles at once rather than looping over them.
+
+    INPUTS:
+        d : dict
+            The dictionary output of mpl2nc.process_mpl
+
+    OUTPUTS:
+        d : dict
+            The input dictionary, with the nrb_copol and nrb_crosspol variables added.
+    '''
+    d['nrb_copol'] = _calc_nrb(d, 'channel_2', '_copol', '_2')
+    d['nrb_crosspol'] = _calc_nrb(d, 'channel_1', '_crosspol', '')
+    return d
+
+
+def _calc_nrb(d, channel, name, name2):
+    '''Vectorised rewriting of mpl2nc.calc_nrb, with the per profile quantities broadcast along the range dimension.'''
+    raw = d[channel]
+    n, m = raw.shape
+    background = d['background_average' + name2][:,np.newaxis]
+    ap = d.get('ap' + name, np.zeros(m, np.float64))
+    energy = (d['energy_monitor']*1e-3)[:,np.newaxis]
+    ap_energy = d.get('ap_energy', 1.)
+    ap_background = d.get('ap_background_average' + name, 0.)
+    ol_range = d.get('ol_range')
+    ap_range = d.get('ap_range')
+    overlap = d.get('ol_overlap', np.ones(m, np.float64))
+
+    if 'dt_coeff' in d:
+        calc_dtcf = lambda x: mpl2nc.calc_dtcf_from_coeff(x, d['dt_coeff'])
+    elif 'dt_count' in d and 'dt_factor' in d:
+        # calc_dtcf_from_count_factor only accepts 1d arrays, so the arrays are flattened
+        calc_dtcf = lambda x: mpl2nc.calc_dtcf_from_count_factor(np.ravel(x), d['dt_count'], d['dt_factor']).reshape(np.shape(x))
+    else:
+        calc_dtcf = lambda x: 1
+
+    # (n, m) array of the range of each bin, as the bin time can vary between profiles
+    range_ = 0.5*d['bin_time'][:,np.newaxis]*mpl2nc.C*(np.arange(m) + 0.5)*1e-3
+    # the interpolation points are the same for all profiles, so the flattened ranges can be interpolated together
+    ap2 = np.interp(range_.ravel(), ap_range, ap).reshape(n, m) if ap_range is not None else ap
+    overlap2 = np.interp(range_.ravel(), ol_range, overlap).reshape(n, m) if ol_range is not None else overlap
+
+    nrb = (raw*calc_dtcf(raw) - \
+        background*calc_dtcf(background) - \
+        ap2*calc_dtcf(ap2)*energy/ap_energy + \
+        ap_background*calc_dtcf(ap_background)*energy/ap_energy)* \
+        range_**2/(overlap2*energy)
+
+    return nrb.astype(np.float64, copy=False)
+
+
 def mpl2nc_read_mpl_gzip(fname):
     '''Effective rewriting of mpl2nc.read_mpl to use gzip.open() rather than open().
+
+    The compressed file and the decompressed stream are both read through 1MB buffers, as mpl2nc.read_mpl_profile makes many small reads for the profile headers.
     
     INPUTS:
         fname : string
             Full filename of the .mpl.gz file to be opened, including the file extension.
     '''
     dd = []
-    with gzip.open(fname,'rb') as f:
+    with open(fname, 'rb', buffering=1<<20) as f_raw, io.BufferedReader(gzip.GzipFile(fileobj=f_raw, mode='rb'), buffer_size=1<<20) as f:
         while True:
             d = mpl2nc.read_mpl_profile(f)
             if d is None:
@@ -55,7 +144,9 @@ def mpl2nc_read_mpl_gzip(fname):
 
 def mpl_dict_to_xarray(d):
     '''Convert the mpl2nc mpl dictionary to an xr.Dataset format.
-    Rewrites the mpl2nc.write() function, except that the Dataset isn't saved to memory.
+    Rewrites the mpl2nc.write() function, except that the Dataset is built directly rather than being written to a (diskless) netCDF file and read back.
+
+    The variables are cast, filled and padded as they would be when written to the netCDF file with unlimited dimensions, and then decoded with xr.decode_cf, as in xr.open_dataset.
     
     INPUTS:
         d : dict
@@ -65,30 +156,129 @@ def mpl_dict_to_xarray(d):
         ds : xr.Dataset
             The xarray dataset created from the mpl dictionary.
     '''
-    f = netCDF4.Dataset('diskless.nc','w',diskless=True)
-    f.createDimension('profile', None)
-    f.createDimension('range', None)
-    f.createDimension('ap_range', None)
-    f.createDimension('ol_range', None)
-    f.createDimension('dt_coeff_degree', None)
+    return _data_vars_to_xarray(_mpl_dict_to_data_vars(d))
+
+
+def _mpl_dict_to_data_vars(d):
+    '''Function to cast, fill and pad the variables of the mpl2nc mpl dictionary, returning a dictionary of (dims, array, attrs) tuples that can be passed to xr.Dataset.'''
+    arrays = {}
+    sizes = {} # the dimensions are unlimited in the netCDF file, so take the largest extent of the variables along them
     for k, v in d.items():
         h = mpl2nc.NC_HEADER[k]
-        var = f.createVariable(k, mpl2nc.NC_TYPE[h['dtype']], h['dims'],
-            fill_value=mpl2nc.FILL_VALUE[h['dtype']])
-        var[::] = v
-        if h['units'] is not None: var.units = h['units']
-        if h['long_name'] is not None: var.long_name = h['long_name']
-        if h['comment'] is not None: var.comment = h['comment']
-    f.created = datetime.datetime.utcnow().strftime('%Y-%m-%dT:%H:%M:%SZ')
-    f.software = 'mpl2nc (https://github.com/peterkuma/mpl2nc)'
-    f.version = mpl2nc.__version__
-
-    ds = xr.open_dataset(xr.backends.NetCDF4DataStore(f)).load()
-    f.close()
-    return ds
+        fill = mpl2nc.FILL_VALUE[h['dtype']]
+        arr = np.ma.filled(np.ma.asarray(v).astype(mpl2nc.NC_TYPE[h['dtype']]), fill)
+        if arr.dtype.kind == 'S': # fixed-width strings are read back from the netCDF file as python strings
+            arr = arr.astype(str).astype(object)
+        arrays[k] = arr
+        for dim, n in zip(h['dims'], arr.shape):
+            sizes[dim] = max(sizes.get(dim, 0), n)
+
+    data_vars = {}
+    for k, arr in arrays.items():
+        h = mpl2nc.NC_HEADER[k]
+        fill = mpl2nc.FILL_VALUE[h['dtype']]
+        pad = [(0, sizes[dim] - n) for dim, n in zip(h['dims'], arr.shape)]
+        if any(after > 0 for _, after in pad):
+            arr = np.pad(arr, pad, constant_values=fill)
+        attrs = {'_FillValue': fill}
+        for a in ('units', 'long_name', 'comment'):
+            if h[a] is not None: attrs[a] = h[a]
+        data_vars[k] = (tuple(h['dims']), arr, attrs)
+    return data_vars
+
 
+def _data_vars_to_xarray(data_vars):
+    '''Function to create the decoded xr.Dataset from the dictionary of (dims, array, attrs) tuples, with the global attributes set by mpl2nc.write().'''
+    attrs = {
+        'created': datetime.datetime.utcnow().strftime('%Y-%m-%dT:%H:%M:%SZ'),
+        'software': 'mpl2nc (https://github.com/peterkuma/mpl2nc)',
+        'version': mpl2nc.__version__,
+    }
+    return xr.decode_cf(xr.Dataset(data_vars, attrs=attrs))
 
-def mf_load_mpl_inline(fname_fmt, dir_root):
+
+def _concat_data_vars(data_vars_list, fnames=None):
+    '''Function to concatenate the (dims, array, attrs) dictionaries of several files along the profile dimension.
+
+    The output arrays are allocated once and each file is copied into its slice, rather than building a Dataset for each file and concatenating them.
+    Variables without a profile dimension are broadcast along it, as xr.concat would do with the default data_vars='all', except for the dimension coordinates (e.g. ap_range), which are taken from the first file.
+    The files must therefore have the same variables, with the same shapes apart from the profile dimension and the same dimension coordinates, otherwise a ValueError naming the mismatching files is raised.
+
+    INPUTS:
+        data_vars_list : list
+            list of the dictionaries output by _mpl_dict_to_data_vars, one for each file, in order.
+
+        fnames : None, list
+            the names of the files, in the same order, used in the error message. If None, the files are referred to by their index.
+
+    OUTPUTS:
+        data_vars : dict
+            dictionary of (dims, array, attrs) tuples containing the concatenated variables.
+    '''
+    if fnames is None:
+        fnames = [f'file {i}' for i in range(len(data_vars_list))]
+    mismatched = [fname for fname, dv in zip(fnames[1:], data_vars_list[1:]) if not _same_layout(data_vars_list[0], dv)]
+    if len(mismatched) > 0:
+        msg = f'_concat_data_vars: the variables, shapes or dimension coordinates of {mismatched} differ from those of {fnames[0]}, so the files cannot be concatenated along profile'
+        raise ValueError(msg)
+
+    # counting pass for the number of profiles in each file, taken from the fill padded variables
+    n_profiles = []
+    for dv in data_vars_list:
+        n = 0
+        for dims, arr, _ in dv.values():
+            if 'profile' in dims:
+                n = arr.shape[dims.index('profile')]
+                break
+        n_profiles.append(n)
+    starts = np.concatenate([[0], np.cumsum(n_profiles)])
+    total = int(starts[-1])
+
+    data_vars = {}
+    for k, (dims, arr, attrs) in data_vars_list[0].items():
+        if k in dims and 'profile' not in dims:
+            # dimension coordinates are aligned rather than concatenated
+            data_vars[k] = (dims, arr, attrs)
+            continue
+        if 'profile' in dims:
+            axis = dims.index('profile')
+            out_dims = dims
+        else:
+            axis = 0
+            out_dims = ('profile',) + dims
+        shape = list(arr.shape) if 'profile' in dims else [0] + list(arr.shape)
+        shape[axis] = total
+        out = np.empty(shape, dtype=arr.dtype)
+        out_ = np.moveaxis(out, axis, 0) # view, so that each file fills a slice of the first axis
+        for i, dv in enumerate(data_vars_list):
+            arr_i = dv[k][1]
+            if 'profile' in dims:
+                arr_i = np.moveaxis(arr_i, axis, 0)
+            out_[starts[i]:starts[i+1]] = arr_i
+        data_vars[k] = (out_dims, out, attrs)
+    return data_vars
+
+
+def _same_layout(dv_ref, dv):
+    '''Function to check that the (dims, array, attrs) dictionaries dv_ref and dv have the same variables, dimensions, shapes (apart from along profile) and dimension coordinates, see _concat_data_vars.'''
+    if dv_ref.keys() != dv.keys():
+        return False
+    for k, (dims, arr, _) in dv_ref.items():
+        dims_i, arr_i, _ = dv[k]
+        if dims_i != dims:
+            return False
+        if k in dims and 'profile' not in dims:
+            if not np.array_equal(arr_i, arr):
+                return False
+            continue
+        shape = [n for dim, n in zip(dims, arr.shape) if dim != 'profile']
+        shape_i = [n for dim, n in zip(dims_i, arr_i.shape) if dim != 'profile']
+        if shape_i != shape:
+            return False
+    return True
+
+
+def mf_load_mpl_inline(fname_fmt, dir_root, n_jobs=-1, cache_dir=None):
     '''Function to load multiple .mpl.gz files inline.
     
     INPUTS:
@@ -97,6 +287,12 @@ def mf_load_mpl_inline(fname_fmt, dir_root):
 
         dir_root : string
             path to the root directory containing the .mpl.gz files
+
+        n_jobs : int
+            The number of worker processes used to read the files. -1 uses all available cores, and 1 reads the files sequentially in the current process.
+
+        cache_dir : None, string
+            directory in which the processed mpl dictionaries are cached, see _read_process_mpl_gzip. If None, the files are always read.
             
     OUTPUTS:
         ds : xr.Dataset
@@ -105,14 +301,34 @@ def mf_load_mpl_inline(fname_fmt, dir_root):
 
     fnames = glob.glob(fname_fmt, root_dir=dir_root)
     fnames = sorted(fnames)
-    fnames = [n for n in fnames if '.mpl.gz' in n[-7:]] # ensure all files are .mpl.gz
-
-    ds = []
-    for fname in fnames:
-        n = os.path.join(dir_root,fname)
-        print(f'loading {fname}')
-        ds.append(load_mpl_inline(n))
-    ds = xr.combine_nested(datasets=ds, concat_dim='profile', combine_attrs='override')
+    fnames = [n for n in fnames if n.endswith('.mpl.gz')] # ensure all files are .mpl.gz
+    if len(fnames) == 0:
+        msg = f'mf_load_mpl_inline: no .mpl.gz files matching {fname_fmt=} found in {dir_root=}'
+        raise FileNotFoundError(msg)
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    n_jobs = max(1, min(n_jobs, len(fnames)))
+
+    paths = [os.path.join(dir_root,fname) for fname in fnames]
+    read_process = functools.partial(_read_process_mpl_gzip, cache_dir=cache_dir)
+    if n_jobs == 1:
+        mpls = map(read_process, paths)
+    else:
+        executor = ProcessPoolExecutor(max_workers=n_jobs)
+        mpls = executor.map(read_process, paths)
+
+    # the variables are prepared in the main process, as the files are returned in order
+    data_vars_list = []
+    try:
+        for fname, mpl in zip(fnames, mpls):
+            print(f'loading {fname}')
+            data_vars_list.append(_mpl_dict_to_data_vars(mpl))
+    finally:
+        if n_jobs > 1:
+            executor.shutdown()
+    # the files are concatenated into preallocated arrays, and a single xr.Dataset is created
+    ds = _data_vars_to_xarray(_concat_data_vars(data_vars_list, fnames))
     return ds
 
 
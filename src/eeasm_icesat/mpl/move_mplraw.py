@@ -5,12 +5,14 @@ Function to move raw mpl.gz files from the ICECAPSarchive to a desired target lo
 '''
 
 import os
-import shutil
 import datetime as dt
 import warnings
+from eeasm_icesat._utils.fs import cached_files, copy_files
+from eeasm_icesat._utils.dt import remove_minute_from_datetime
 
-def move_mplraw(dir_target, dir_mpl='/gws/nopw/j04/ncas_radar_vol2/data/ICECAPSarchive/mpl/raw', date_range=None, filenames_list=None, verbose=False):
+def move_mplraw(dir_target, dir_mpl='/gws/nopw/j04/ncas_radar_vol2/data/ICECAPSarchive/mpl/raw', date_range=None, filenames_list=None, link_if_possible=False, n_threads=16, index=None, verbose=False):
     '''Function to move .mpl.gz raw files from the ICECAPS archive to a desired target directory.
+    Files that already exist in dir_target/mplraw_zip are not copied again.
 
     INPUTS:
         dir_target : string
@@ -25,6 +27,16 @@ def move_mplraw(dir_target, dir_mpl='/gws/nopw/j04/ncas_radar_vol2/data/ICECAPSa
         filenames_list : None, iterable of strings
             Iterable of strings that will serve as the filenames to be copied - must be exact matches including file extensions.
 
+        link_if_possible : boolean
+            if True, the files are hard linked into dir_target rather than copied when dir_mpl and dir_target are on the same filesystem. Otherwise, or if linking fails, the files are copied.
+            WARNING: a hard linked file shares its data with the archived file, so writing to or truncating the file in dir_target also changes the archive. Only use this if the files in dir_target are never modified in place.
+
+        n_threads : int
+            The number of threads used to copy the files, as the copies from the archive are latency bound. 1 copies the files sequentially.
+
+        index : None, dict
+            dictionary of cached directory listings shared between the stages of get_mpl_from_archive, see _utils.fs.cached_files. If None, the directories are scanned.
+
         verbose : boolean
             if True, status for each file will be printed. If False, this will be in a compressed, single-line format
 
@@ -51,48 +63,47 @@ def move_mplraw(dir_target, dir_mpl='/gws/nopw/j04/ncas_radar_vol2/data/ICECAPSa
         date_init = date_range[0]
         date_end = date_range[1]
         # need to round to the hour: down for date_init; up for date_end
-        date_init = _remove_minute_from_datetime(date_init)
-        date_end = _remove_minute_from_datetime(date_end)
+        date_init = remove_minute_from_datetime(date_init)
+        date_end = remove_minute_from_datetime(date_end)
 
+        filenames = []
         currentDate = date_init
-
-        if verbose: print('move_mplraw: ')
-        else: print(f'{"move_mplraw":>20}: ',end='')
-
         while currentDate <= date_end:
             # for each datetime in the range, we need to create the expected filename and see if its in the directory
-            current_filename = currentDate.strftime(mpl_filename_format)
-            exists_archive = os.path.exists(os.path.join(dir_mpl,current_filename))
-            exists_destination = os.path.exists(os.path.join(dir_target,current_filename))
+            filenames.append(currentDate.strftime(mpl_filename_format))
+            currentDate = currentDate + dt_hour
+    else:
+        # otherwise, filenames_list has been provided. Duplicates are removed, keeping the order.
+        filenames = list(dict.fromkeys(filenames_list))
 
-            if verbose: print(f'{current_filename} | {exists_archive=} | {exists_destination=}')
-            else: print(f'{exists_archive*2 + exists_destination}', end='')
+    # list the directories once, rather than checking for each file individually
+    files_archive = cached_files(dir_mpl, index)
+    files_destination = cached_files(dir_target, index)
 
-            shutil.copy(os.path.join(dir_mpl,current_filename),os.path.join(dir_target,current_filename))
+    if verbose: print('move_mplraw: ')
+    else: print(f'{"move_mplraw":>20}: ',end='')
 
-            currentDate = currentDate + dt_hour
-        
-        if verbose: print('move_mplraw: complete')
-        else: print('')
-        return
+    # the files to copy are collected, and then copied together
+    paths_copy = []
 
-    # otherwise, filenames_list has been provided
-    raise NotImplementedError
+    for current_filename in filenames:
+        exists_archive = current_filename in files_archive
+        exists_destination = current_filename in files_destination
 
-def _remove_minute_from_datetime(dtObj):
-    '''Function to remove the minute (and finer) component(s) from a datetime object.
+        if verbose: print(f'{current_filename} | {exists_archive=} | {exists_destination=}')
+        else: print(f'{exists_archive*2 + exists_destination}', end='')
+
+        # files already in dir_target are kept, as in move_from_gws2, rather than copied again
+        if exists_archive and not exists_destination:
+            paths_copy.append((os.path.join(dir_mpl,current_filename),os.path.join(dir_target,current_filename)))
+
+    copy_files(paths_copy, n_threads, link_if_possible)
+    files_destination.update(os.path.basename(dst) for _, dst in paths_copy)
     
-    INPUTS:
-        dtObj : pydt.datetime object
-            The datetime object for which we want to remove the minute component (round down).
-            
-    OUTPUTS:
-        dtObj_ : pydt.datetime object
-            The datetime object with the minute and finer components removed.
-    '''
-    d_hour_string = f'{dtObj.year:04}-{dtObj.month:02}-{dtObj.day:02}T{dtObj.hour:02}:00:00'
-    dtObj_ = dt.datetime.fromisoformat(d_hour_string)
-    return dtObj_
+    if verbose: print('move_mplraw: complete')
+    else: print('')
+    return
+
 
 '''
 #Example code
@@ -101,4 +112,4 @@ end = dt.datetime(2019,1,1,23,13)
 range = [start, end]
 target = '/home/users/eeasm/_scripts/ICESat2/src/mpl'
 move_mplraw(target,date_range=range)
-'''
\ No newline at end of file
+'''
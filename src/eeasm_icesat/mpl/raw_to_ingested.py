@@ -9,17 +9,25 @@ import datetime
 import xarray as xr
 import netCDF4
 import os
-import glob
+import tempfile
+import functools
+from concurrent.futures import ProcessPoolExecutor
 
 # import local packages
+from eeasm_icesat._utils.fs import cached_files, copy_files
 
 
+# the shape of the ingested format: a day of 5 second profiles, with the full or limited number of height bins
+N_TIME = 17280
+N_HEIGHT_FULL = 1999
+N_HEIGHT_LIMITED = 1200
 
 
-def raw_to_ingested(dir_target,date,limit_height=True, c=299792458, data_loaded=None):
+def raw_to_ingested(dir_target,date,limit_height=True, c=299792458, data_loaded=None, n_jobs=-1, index=None, local_dir=None, cache=False):
     '''Convert hourly mpl files to the Summit ingested format.
 
     The function will take hourly .nc files (created by mpl2nc) and concatenate them to produce a file matching the Summit ingested mpl format.
+    If data_loaded is None and 24 hourly files aren't found for the date in dir_target, a FileNotFoundError is raised.
     
     The raw mpl data contains more height bins than the ingested format does. As such, I'll give the option to maintain that information or drop it to match the original format exactly.
 
@@ -36,8 +44,20 @@ def raw_to_ingested(dir_target,date,limit_height=True, c=299792458, data_loaded=
         c : float : default=3e8 ; [m/s]
             The speed of light, in m/s, used to calculate the height bins. Summit uses 3e8, but mpl2nc uses the SI defined c=299792458m/s
 
-        data_loaded : None, xr.Dataset
-            If the mpl dataset has already been loaded, we can skip the loading files phase and go straight to the conversion.
+        data_loaded : None, xr.Dataset, dict
+            If the mpl dataset has already been loaded (e.g. by mf_load_mpl_inline), we can skip the loading files phase and go straight to the conversion. The variables required for the conversion are taken from the dataset, or the dict of numpy arrays returned by load_variables.
+
+        n_jobs : int
+            The number of worker processes used to read the hourly files, see load_variables.
+
+        index : None, dict
+            dictionary of cached directory listings, see _utils.fs.cached_files, so that dir_target is only listed once when converting many days. If None, the directory is scanned.
+
+        local_dir : None, string
+            directory on a local disk (e.g. /tmp or /dev/shm) that the hourly files are staged into before being read, see load_variables. If None, the files are read from dir_target.
+
+        cache : boolean
+            If True, the variables loaded for the day are kept in memory (for the last 8 days loaded), so that converting the same day again (e.g. with a different c) doesn't read the files again. The files are read again if they have been modified. The cached arrays are read-only, and may be shared with the returned dataset.
 
     OUTPUTS:
         ds : xr.Dataset
@@ -54,44 +74,51 @@ def raw_to_ingested(dir_target,date,limit_height=True, c=299792458, data_loaded=
 
     if data_loaded is None:
         # get files in dir_target that match the date given
-        filename_fmt = f'{date.year:04}{date.month:02}{date.day:02}*.nc'
-        mpl_filenames = sorted(glob.glob(filename_fmt,root_dir=dir_target))
-        # if not 24 files are found, then the function will break and return None
+        prefix = f'{date.year:04}{date.month:02}{date.day:02}'
+        mpl_filenames = sorted(f for f in cached_files(dir_target, index) if f.startswith(prefix) and f.endswith('.nc'))
+        # if not 24 files are found, then the day can't be converted
         if len(mpl_filenames) != 24:
-            print(f'raw_to_ingested: For full day, 24 files are expected. {len(mpl_filenames)} files matching date {date} in {dir_target=} found.')
-            return False
-
-        # load in the data to an xarray dataset
-        data_loaded = xr.open_mfdataset(str(os.path.join(dir_target, filename_fmt)), combine='nested',concat_dim='profile') # open_mfdataset allows glob strings
+            msg = f'raw_to_ingested: For full day, 24 files are expected. {len(mpl_filenames)} files matching date {date} in {dir_target=} found.'
+            raise FileNotFoundError(msg)
+
+        # load in the required variables as numpy arrays
+        # if the height is limited, only the lowest range bins are read from the files
+        n_range = N_HEIGHT_LIMITED if limit_height else None
+        fnames = [os.path.join(dir_target, fname) for fname in mpl_filenames]
+        if cache:
+            # the modification time and size are part of the key, so that rewritten files aren't read from the cache
+            files = tuple((fname, st.st_mtime_ns, st.st_size) for fname, st in zip(fnames, map(os.stat, fnames)))
+            data_loaded = _load_variables_cached(files, n_range, n_jobs, local_dir)
+        else:
+            data_loaded = load_variables(fnames, n_jobs=n_jobs, n_range=n_range, local_dir=local_dir)
+    elif isinstance(data_loaded, xr.Dataset):
+        data_loaded = {k: data_loaded[k].values for k in VARIABLES_LOADED}
 
-    # create ingested dataset, with appropriate dimensions and height coordinates
-    ds = xr.Dataset()
     # set the dimensions for the dataset
-    dims = {'time':17280, 'height':1999}
+    dims = {'time':N_TIME, 'height':N_HEIGHT_FULL}
     if limit_height: 
-        dims['height'] = 1200
+        dims['height'] = N_HEIGHT_LIMITED
     
-    args = {'num_bins': dims['height'], 'bin_time':data_loaded['bin_time'].values[0], 'c':c, 'v_offset':3000}
+    args = {'num_bins': dims['height'], 'bin_time':data_loaded['bin_time'][0], 'c':c, 'v_offset':3000}
     heights = generate_heights(**args)
-    times = data_loaded.time.values
-
-    ds = ds.assign_coords({'time': times,'height':heights})
+    times = data_loaded['time']
 
-    # for each variable in VARIABLES_INGESTED, create the appropriate data, and turn it into a DataArray
-    ingest_kwargs = {'limit_height':True}
+    # for each variable in VARIABLES_INGESTED, create the appropriate data. The variables are collected, so that the dataset is created at once rather than assigning each variable in turn
+    ingest_kwargs = {'limit_height':limit_height}
+    data_vars = {}
     for k,l in VARIABLES_INGESTED.items():
         # create the data based on the ingestion function
         if l[3] is None:
             continue
         temp = l[3](data_loaded,**ingest_kwargs)
         if type(temp) == np.ndarray:
-            temp = temp.astype(l[1])
+            temp = temp.astype(l[1], copy=False) # no copy if the data already has the ingested dtype
         else:
             temp = l[1](temp)
-        attrs = l[2]
-        dims = l[0]
-        da = xr.DataArray(temp,dims=dims,attrs=attrs)
-        ds[k] = da
+        data_vars[k] = (l[0], temp, l[2])
+
+    # create ingested dataset, with appropriate dimensions and height coordinates
+    ds = xr.Dataset(coords={'time': times,'height':heights}).assign(data_vars)
 
     # create the dataset attributes
     now = datetime.datetime.now(datetime.timezone.utc)
@@ -101,6 +128,170 @@ def raw_to_ingested(dir_target,date,limit_height=True, c=299792458, data_loaded=
     return ds
 
 
+def write_ingested(ds, fname, backend='netcdf', chunks=None, compression=None):
+    '''Function to write the ingested dataset to a file.
+
+    With backend='netcdf' and compression='zstd', the array variables are compressed with zstandard and bit shuffling (through the blosc filter, as netCDF4 only applies its own shuffle filter with zlib), which is faster and smaller than zlib. This requires netCDF-C >= 4.9 with the blosc filter available to netCDF4.
+
+    With both backends, the array variables are written in chunks aligned with the hourly files, so that reading an hour of profiles touches a few chunks rather than one per profile, as the default netCDF4 chunking would.
+
+    With backend='zarr', the variables are compressed with zstd, and with consolidated metadata, so that the store can be read in parallel and opened remotely with a single read of the metadata. This requires the zarr package (and numcodecs for zarr < 3).
+
+    INPUTS:
+        ds : xr.Dataset
+            The ingested dataset, from raw_to_ingested.
+
+        fname : string
+            The full filename of the output file (or zarr store directory).
+
+        backend : string
+            'netcdf' to write a single netCDF file as in the Summit ingested format, or 'zarr' to write a chunked zarr store.
+
+        chunks : None, dict
+            dictionary of the chunk size for each dimension of the array variables. If None, each chunk holds an hour of 5 second profiles and half of the height bins.
+
+        compression : None, string
+            The compression of the netCDF variables. None writes them uncompressed, 'zstd' compresses them with zstandard (complevel 3) and bit shuffling, and other values are passed to the netCDF4 compression encoding with shuffling (e.g. 'zlib').
+    '''
+    if chunks is None:
+        chunks = {'time': N_TIME // 24, 'height': (ds.sizes['height'] + 1) // 2}
+    def var_chunks(v):
+        return tuple(min(chunks.get(dim, n), n) for dim, n in v.sizes.items())
+
+    if backend == 'netcdf':
+        # scalar variables can't be chunked or compressed, so only the array variables are encoded
+        var_encoding = {}
+        if compression == 'zstd':
+            var_encoding = {'compression': 'blosc_zstd', 'complevel': 3, 'blosc_shuffle': 2} # blosc_shuffle=2 is bit shuffling
+        elif compression is not None:
+            var_encoding = {'compression': compression, 'complevel': 3, 'shuffle': True}
+        encoding = {k: {**var_encoding, 'chunksizes': var_chunks(v)} for k, v in ds.data_vars.items() if v.ndim > 0}
+        ds.to_netcdf(fname, engine='netcdf4', encoding=encoding)
+        return None
+    if backend == 'zarr':
+        try:
+            import zarr
+        except ImportError:
+            print('write_ingested: zarr is required for backend="zarr"')
+            raise
+        # zarr >= 3 takes a tuple of codecs as 'compressors', whereas zarr 2 takes a single numcodecs compressor
+        if int(zarr.__version__.split('.')[0]) >= 3:
+            from zarr.codecs import BloscCodec
+            codec_encoding = {'compressors': (BloscCodec(cname='zstd', clevel=3, shuffle='bitshuffle'),)}
+        else:
+            from numcodecs import Blosc
+            codec_encoding = {'compressor': Blosc(cname='zstd', clevel=3, shuffle=Blosc.BITSHUFFLE)}
+        encoding = {}
+        for k, v in ds.data_vars.items():
+            encoding[k] = dict(codec_encoding)
+            if v.ndim > 0:
+                encoding[k]['chunks'] = var_chunks(v)
+        ds.to_zarr(fname, mode='w', encoding=encoding, consolidated=True)
+        return None
+    msg = f'write_ingested: unknown backend {backend}'
+    raise ValueError(msg)
+
+
+# the variables from the mpl2nc files that are used by the ingested_* functions
+VARIABLES_LOADED = ('time', 'bin_time', 'shots_sum', 'trigger_frequency', 'energy_monitor', 'temp_0', 'temp_2', 'temp_3',
+    'background_average', 'background_stddev', 'background_average_2', 'background_stddev_2', 'channel_1', 'channel_2')
+
+def load_variables(fnames, variables=VARIABLES_LOADED, n_jobs=-1, n_range=None, local_dir=None):
+    '''Function to read the variables required for the ingested format from the hourly mpl2nc files, as numpy arrays concatenated along the profile dimension.
+
+    The files are read with netCDF4 rather than xr.open_mfdataset, so that no dask graph or intermediate xarray objects are created. The files are read in parallel worker processes, and then each variable is allocated once for all of the profiles and each file is copied into its slice. The values are masked and decoded as xr.open_mfdataset would: fill values are replaced by NaN and the times are converted to np.datetime64.
+
+    INPUTS:
+        fnames : list
+            Sorted list of the full filenames of the .nc files produced by mpl2nc.
+
+        variables : iterable of strings
+            The names of the variables to be read.
+
+        n_jobs : int
+            The number of worker processes used to read the files. -1 uses all available cores, and 1 reads the files sequentially in the current process.
+
+        n_range : None, int
+            If an int, only the first n_range bins of the variables with a range dimension (channel_1, channel_2) are read from the files. If None, all of the range bins are read.
+
+        local_dir : None, string
+            If a string, the files are first copied into a temporary directory within local_dir, read from there, and the copies removed afterwards. On network mounted filesystems the many small reads made by HDF5 each pay the round-trip latency, whereas the copies are made with large sequential reads, overlapped in threads (see _utils.fs.copy_files). If None, the files are read where they are.
+
+    OUTPUTS:
+        dsl : dict
+            dictionary of numpy arrays for each of the variables.
+    '''
+    if local_dir is not None:
+        with tempfile.TemporaryDirectory(dir=local_dir) as dir_tmp:
+            fnames_local = [os.path.join(dir_tmp, os.path.basename(fname)) for fname in fnames]
+            copy_files(zip(fnames, fnames_local))
+            return load_variables(fnames_local, variables=variables, n_jobs=n_jobs, n_range=n_range)
+
+    variables = tuple(variables)
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    n_jobs = max(1, min(n_jobs, len(fnames)))
+
+    if n_jobs == 1:
+        files = [_read_variables(fname, variables, n_range) for fname in fnames]
+    else:
+        # the netCDF4/HDF5 libraries are not thread safe, so the files are read in separate processes
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            files = list(executor.map(_read_variables, fnames, [variables]*len(fnames), [n_range]*len(fnames)))
+    files, time_encodings = zip(*files)
+
+    # the times are decoded once for all of the files, unless the files have different time units
+    decode_once = len(set(time_encodings)) == 1
+    if 'time' in variables and not decode_once:
+        for f, encoding in zip(files, time_encodings):
+            f['time'] = xr.coding.times.decode_cf_datetime(f['time'], *encoding)
+
+    starts = np.cumsum([0] + [len(f[variables[0]]) for f in files])
+    dsl = {}
+    for k in variables:
+        # if fill values are only found in some files, the integer variables are promoted to float so the NaNs can be stored
+        dtype = np.result_type(*[f[k] for f in files])
+        out = np.empty((starts[-1],) + files[0][k].shape[1:], dtype=dtype)
+        for f, start, end in zip(files, starts[:-1], starts[1:]):
+            out[start:end] = f[k]
+        dsl[k] = out
+
+    if 'time' in variables and decode_once:
+        dsl['time'] = xr.coding.times.decode_cf_datetime(dsl['time'], *time_encodings[0])
+    return dsl
+
+
+@functools.lru_cache(maxsize=8)
+def _load_variables_cached(files, n_range, n_jobs, local_dir):
+    '''Function to return the variables loaded from the files, reusing previously loaded variables (see raw_to_ingested). files is a tuple of (fname, mtime_ns, size) tuples.
+
+    The cached arrays are set to read-only, as they are shared between calls.
+    '''
+    dsl = load_variables([f[0] for f in files], n_jobs=n_jobs, n_range=n_range, local_dir=local_dir)
+    for v in dsl.values():
+        v.setflags(write=False)
+    return dsl
+
+
+def _read_variables(fname, variables, n_range=None):
+    '''Function to read and mask the variables from a single mpl2nc file, see load_variables. The times are not decoded, and the (units, calendar) of the time variable are returned with the values.'''
+    values = {}
+    time_encoding = None
+    with netCDF4.Dataset(fname) as nc:
+        for k in variables:
+            var = nc.variables[k]
+            # the range bins are sliced in the read, so that the higher bins are not read from the file
+            index = tuple(slice(n_range) if dim == 'range' else slice(None) for dim in var.dimensions)
+            v = var[index]
+            if v.dtype.kind == 'f' or np.ma.is_masked(v):
+                v = np.ma.filled(v.astype(np.promote_types(v.dtype, np.float32), copy=False), np.nan)
+            v = np.ma.getdata(v)
+            if k == 'time':
+                time_encoding = (var.units, getattr(var, 'calendar', None))
+            values[k] = v
+    return values, time_encoding
+
+
 def generate_heights(num_bins, bin_time, c, v_offset=3000):
     '''Function to generate the heights for each bin based on the measurement frequency, speed of light and vertical offset.
     
@@ -153,30 +344,30 @@ def ingest_base_time(dsl, **kwargs):
     '''Create the ingested base_time variable.
     
     INPUTS:
-        dsl : xr.Dataset
-            The loaded dataset.
+        dsl : dict
+            The loaded variables, as numpy arrays (see load_variables).
     
     OUTPUTS:
         base_time : float
             The variable for base_time in the ingested data.
     '''
     
-    base_time = dsl.time.values[0]
+    base_time = dsl['time'][0]
     return base_time
 
 def ingested_time_offset(dsl, **kwargs):
     '''Create the ingested time_offset variable.
     
     INPUTS:
-        dsl : xr.Dataset
-            The loaded dataset.
+        dsl : dict
+            The loaded variables, as numpy arrays (see load_variables).
             
     OUTPUTS:
         time_offset : np.ndarray (time,)
             The time offset from the base time.
     '''
-    base_time = dsl.time.values[0]
-    time_offset = dsl.time.values - base_time
+    base_time = dsl['time'][0]
+    time_offset = dsl['time'] - base_time
     return time_offset
 
 def ingested_hour(dsl, **kwargs):
@@ -184,48 +375,47 @@ def ingested_hour(dsl, **kwargs):
     NOTE: This approach gives a linear error from O(-5e-4) to 0 over 24 hours
 
     INPUTS:
-        dsl : xr.Dataset
-            raw loaded dataset
+        dsl : dict
+            The loaded variables, as numpy arrays (see load_variables).
 	    
 	OUTPUTS:
         hour : np.ndarray (time,)
             Array containing the hour values for the measurements.
     '''
-    time = dsl.time.values
-    time_init = time[0]
+    # the hours are calculated from the integer nanoseconds since the start of the first day, rather than by converting each time to a python object
+    ns_day = 86400 * 10**9
+    time = dsl['time'].astype('datetime64[ns]').astype(np.int64)
+    midnight = (time[0] // ns_day) * ns_day
 
-    date = datetime64_to_datetime(time_init)
-    date_delta = date - date.replace(hour=0,minute=0,second=0,microsecond=0)
-    
-    delta = (((time - time_init).astype(datetime.datetime) / 1e9 + date_delta.total_seconds()) / 3600 ) % 24 #conversion to hours
+    delta = ((time - midnight) / 3.6e12) % 24 #conversion to hours
     return delta
 
 def ingested_nshots(dsl, **kwargs):
 	'''Create the ingested nshots variable.
     
     INPUTS:
-        dsl : xr.Dataset
-	        The raw loaded dataset
+        dsl : dict
+	        The loaded variables, as numpy arrays (see load_variables).
 	    
     OUTPUTS:
         nshots : np.ndarray (time,)
 	        numpy array containing the summed shots per measurement.
 	'''
-	nshots = dsl.shots_sum.values
+	nshots = dsl['shots_sum']
 	return nshots
 
 def ingested_rep_rate(dsl, **kwargs):
 	'''Create the ingested rep_rate variable.
     
     INPUTS:
-        dsl : xr.Dataset
-	        The raw loaded dataset
+        dsl : dict
+	        The loaded variables, as numpy arrays (see load_variables).
 	    
     OUTPUTS:
         rep_rate : np.ndarray (time,)
 	        numpy array containing the shot frequency data.
 	'''
-	rep_rate = dsl.trigger_frequency.values
+	rep_rate = dsl['trigger_frequency']
 	return rep_rate
 
 def ingested_energy(dsl, **kwargs):
@@ -233,14 +423,14 @@ def ingested_energy(dsl, **kwargs):
     Note, this formulation doesn't match the ingested value exactly, but the error is O(2e-7) which I deem to be sufficiently small for now.
     
     INPUTS:
-        dsl : xr.Dataset
-	        The raw laoded dataset.
+        dsl : dict
+	        The loaded variables, as numpy arrays (see load_variables).
 	    
     OUTPUTS:
         energy : np.ndarray (time,)
 	        np array with the laser energy output.
 	'''
-	energy = dsl.energy_monitor.values / 1000
+	energy = dsl['energy_monitor'] / 1000
 	return energy
 
 def ingested_temp_detector(dsl, **kwargs):
@@ -248,14 +438,14 @@ def ingested_temp_detector(dsl, **kwargs):
     NOTE: discrepancies between dsl and the original ingested format are due to float64->float32 conversions.
 	
     INPUTS:
-        dsl : xr.Dataset
-	        the raw loaded data.
+        dsl : dict
+	        The loaded variables, as numpy arrays (see load_variables).
 	    
 	OUTPUTS:
         temp_detector : np.ndarray (time,)
 	        numpy array with the detector temperature values.
 	'''
-	temp_detector = dsl.temp_0.values / 100
+	temp_detector = dsl['temp_0'] / 100
 	return temp_detector
 
 def ingested_temp_telescope(dsl, **kwargs):
@@ -263,14 +453,14 @@ def ingested_temp_telescope(dsl, **kwargs):
     NOTE: discrepancies between dsl and the original ingested format are due to float64->float32 conversions.
 	
     INPUTS:
-        dsl : xr.Dataset
-	        the raw loaded data.
+        dsl : dict
+	        The loaded variables, as numpy arrays (see load_variables).
 	    
 	OUTPUTS:
         temp_telescope : np.ndarray (time,)
 	        numpy array with the telescope temperature values.
 	'''
-	temp_telescope = dsl.temp_2.values / 100
+	temp_telescope = dsl['temp_2'] / 100
 	return temp_telescope
 
 def ingested_temp_laser(dsl, **kwargs):
@@ -278,14 +468,14 @@ def ingested_temp_laser(dsl, **kwargs):
     NOTE: discrepancies between dsl and the original ingested format are due to float64->float32 conversions.
 	
     INPUTS:
-        dsl : xr.Dataset
-	        the raw loaded data.
+        dsl : dict
+	        The loaded variables, as numpy arrays (see load_variables).
 	    
 	OUTPUTS:
         temp_laser : np.ndarray (time,)
 	        numpy array with the laser temperature values.
 	'''
-	temp_laser = dsl.temp_3.values / 100
+	temp_laser = dsl['temp_3'] / 100
 	return temp_laser
 
 def ingested_mn_background_1(dsl, **kwargs):
@@ -293,28 +483,28 @@ def ingested_mn_background_1(dsl, **kwargs):
     This is the mean background, and is simply taken from the background_average variable in the raw data.
     
     INPUTS:
-        dsl: xr.Dataset
-	        The loaded dataset
+        dsl : dict
+	        The loaded variables, as numpy arrays (see load_variables).
 	    
     OUTPUTS:
         mn_background_1 : np.ndarray (time,)
             numpy array containing the mean background from channel 1
 	'''
-	mn_background_1 = dsl.background_average.values
+	mn_background_1 = dsl['background_average']
 	return mn_background_1
 
 def ingested_sd_background_1(dsl, **kwargs):
 	'''Create the sd_background_1 ingested variable.
 	
 	INPUTS:
-        dsl : xr.Dataset
-            The loaded raw dataset
+        dsl : dict
+            The loaded variables, as numpy arrays (see load_variables).
 	    
 	OUTPUTS:
         sd_background_1 : np.ndarray (time,)
             Array containing the standard deviation of the background noise values
     '''
-	sd_background_1 = dsl.background_stddev.values
+	sd_background_1 = dsl['background_stddev']
 	return sd_background_1
 	
 def ingested_mn_background_2(dsl, **kwargs):
@@ -322,28 +512,28 @@ def ingested_mn_background_2(dsl, **kwargs):
     This is the mean background, and is simply taken from the background_average variable in the raw data.
     
     INPUTS:
-        dsl: xr.Dataset
-	        The loaded dataset
+        dsl : dict
+	        The loaded variables, as numpy arrays (see load_variables).
 	    
     OUTPUTS:
         mn_background_2 : np.ndarray (time,)
             numpy array containing the mean background from channel 2
 	'''
-    mn_background_2 = dsl.background_average_2.values
+    mn_background_2 = dsl['background_average_2']
     return mn_background_2
 
 def ingested_sd_background_2(dsl, **kwargs):
 	'''Create the sd_background_2 ingested variable.
 	
 	INPUTS:
-        dsl : xr.Dataset
-            The loaded raw dataset
+        dsl : dict
+            The loaded variables, as numpy arrays (see load_variables).
 	    
 	OUTPUTS:
         sd_background_2 : np.ndarray (time,)
             Array containing the standard deviation of the background noise values
     '''
-	sd_background_2 = dsl.background_stddev_2.values
+	sd_background_2 = dsl['background_stddev_2']
 	return sd_background_2
 
 def ingested_initial_cbh(dsl, **kwargs):
@@ -351,22 +541,22 @@ def ingested_initial_cbh(dsl, **kwargs):
 	It appears this is uniformly 0 in the files, so an arbitrary choice of (time,) variable can be used.
     
 	INPUTS:
-        dsl : xr.Dataset
-            The raw loaded dataset
+        dsl : dict
+            The loaded variables, as numpy arrays (see load_variables).
 	    
 	OUPUTS:
         initial_cbh : np.ndarray (time,)
             numpy array that contains the "lowest detected cloud base height". Will be uniformly 0.
     '''
-	initial_cbh = dsl.bin_time.values * 0
+	initial_cbh = dsl['bin_time'] * 0
 	return initial_cbh
 
 def ingested_backscatter_1(dsl,limit_height,**kwargs):
     '''Create the backscatter_1 ingested variable.
     
     INPUTS:
-        dsl : xr.Dataset
-            The loaded dataset
+        dsl : dict
+            The loaded variables, as numpy arrays (see load_variables).
             
         limit_height : boolean
             If true, returns the height-limitted (lowest 1200) backscatter, otherwise returns the backscatter.
@@ -375,17 +565,17 @@ def ingested_backscatter_1(dsl,limit_height,**kwargs):
         backscatter_1 : np.ndarray (time,height)
             numpy array containing data for the backscatter_1 variable.
     '''
-    backscatter_1 = dsl.channel_1.values
+    backscatter_1 = dsl['channel_1']
     if limit_height:
-        backscatter_1 = backscatter_1[:,:1200]
+        backscatter_1 = backscatter_1[:,:N_HEIGHT_LIMITED]
     return backscatter_1
 
 def ingested_backscatter_2(dsl,limit_height,**kwargs):
     '''Create the backscatter_2 ingested variable.
     
     INPUTS:
-        dsl : xr.Dataset
-            The loaded dataset
+        dsl : dict
+            The loaded variables, as numpy arrays (see load_variables).
             
         limit_height : boolean
             If true, returns the height-limitted (lowest 1200) backscatter, otherwise returns the backscatter.
@@ -394,9 +584,9 @@ def ingested_backscatter_2(dsl,limit_height,**kwargs):
         backscatter_2 : np.ndarray (time,height)
             numpy array containing data for the backscatter_2 variable.
     '''
-    backscatter_2 = dsl.channel_2.values
+    backscatter_2 = dsl['channel_2']
     if limit_height:
-        backscatter_2 = backscatter_2[:,:1200]
+        backscatter_2 = backscatter_2[:,:N_HEIGHT_LIMITED]
     return backscatter_2
 
 def ingested_lat(dsl, **kwargs):
@@ -414,11 +604,11 @@ def ingested_lon(dsl, **kwargs):
 def ingested_alt(dsl, **kwargs):
 	'''Create the alt ingested variable.
 	
-	In the ingested format, this variable is given as a line of value 0. The dsl.gps_altitude variable gives a valid number (3200.0 for 11/2/2021). I'll stick with a line of value 0, for consistency.
+	In the ingested format, this variable is given as a line of value 0. The gps_altitude variable gives a valid number (3200.0 for 11/2/2021). I'll stick with a line of value 0, for consistency.
     
     INPUTS:
-        dsl : xr.Dataset
-            The raw loaded dataset
+        dsl : dict
+            The loaded variables, as numpy arrays (see load_variables).
 	    
     OUTPUTS:
         alt : float ()
@@ -0,0 +1,60 @@
+'''Author: Andrew Martin
+Creation date: 14/10/26
+
+Tests that the density field from the gaussian_filter path (convolve_masked_gauss) agrees with the kernal path (convolve_masked with kernal_Gaussian).
+'''
+
+import numpy as np
+
+from eeasm_icesat.dda import dda
+
+
+def _synthetic_data(shape=(120, 200), seed=0):
+    '''Function to create synthetic backscatter data with a block of nan values.'''
+    rng = np.random.default_rng(seed)
+    data = rng.lognormal(size=shape).astype(np.float32)
+    data[30:45, 50:90] = np.nan
+    return data
+
+
+def test_kernal_gaussian_is_centred():
+    # odd and even numbers of pixels in each half-width
+    kernal = dda.kernal_Gaussian(sigma_y=1.5, sigma_x=6.3, cutoff=4)
+    n, m = kernal.shape
+    assert n % 2 == 1 and m % 2 == 1
+    np.testing.assert_allclose(kernal, kernal[::-1, ::-1])
+
+
+def test_gauss_filter_matches_kernal():
+    data = _synthetic_data()
+    mask = np.isnan(data)
+    kernal_args = {'sigma_y': 1.5, 'sigma_x': 6.3, 'cutoff': 4, 'dy': 1, 'dx': 1}
+
+    density_kernal, norm_kernal = dda.convolve_masked(data, mask, dda.kernal_Gaussian(**kernal_args))
+    density_gauss, norm_gauss = dda.convolve_masked_gauss(data, mask, **kernal_args)
+
+    np.testing.assert_allclose(norm_gauss, norm_kernal, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(density_gauss, density_kernal, rtol=1e-4, atol=1e-5)
+
+
+def test_explicit_default_density_args_use_gauss_filter():
+    kernal_args = {'kernalfunc': dda.kernal_Gaussian, 'sigma_y': 1.5, 'sigma_x': 6.3, 'cutoff': 4}
+    assert dda._use_gauss_filter(kernal_args, {})
+    assert dda._use_gauss_filter(kernal_args, {'mode': 'same', 'boundary': 'symm', 'fillvalue': 0})
+    assert not dda._use_gauss_filter(kernal_args, {'boundary': 'fill'})
+    assert not dda._use_gauss_filter(kernal_args, {'mode': 'valid'})
+
+
+def test_fused_matches_combined_mask_float64():
+    data = _synthetic_data().astype(np.float64) + 1e-9 # values that float32 can't represent
+    mask = np.isnan(data)
+    extra_mask = np.zeros_like(mask)
+    extra_mask[80:100, 120:160] = True
+    kernal = dda.kernal_Gaussian(sigma_y=1.5, sigma_x=6.3, cutoff=4)
+
+    density, norm = dda.convolve_masked(data, np.logical_or(mask, extra_mask), kernal)
+    density_fused, norm_fused = dda.convolve_masked_fused(data, mask, extra_mask, kernal)
+
+    assert density_fused.dtype == np.float64
+    np.testing.assert_allclose(norm_fused, norm, rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(density_fused, density, rtol=1e-12, atol=1e-12)
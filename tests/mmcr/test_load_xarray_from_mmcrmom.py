@@ -0,0 +1,44 @@
+'''Author: Andrew Martin
+Creation date: 14/10/26
+
+Tests that the lazy (xr.open_mfdataset) and eager (netCDF4.MFDataset) paths of load_xarray_from_mmcrmom read the same data from small synthetic MMCRMom files.
+'''
+
+import numpy as np
+import xarray as xr
+import netCDF4
+
+from eeasm_icesat.mmcr.load_xarray_from_mmcrmom import load_xarray_from_mmcrmom
+
+
+def _write_mmcrmom(fname, hour, calendar=None, n_time=6, n_heights=4):
+    '''Function to write a synthetic NETCDF3_CLASSIC MMCRMom file, with times in hours since the start of the file's hour so that the time units differ between files.'''
+    rng = np.random.default_rng(hour)
+    with netCDF4.Dataset(fname, 'w', format='NETCDF3_CLASSIC') as nc:
+        nc.createDimension('time', None)
+        nc.createDimension('heights', n_heights)
+        time = nc.createVariable('time', 'f8', ('time',))
+        time.units = f'seconds since 2021-02-10 {hour:02}:00:00'
+        if calendar is not None:
+            time.calendar = calendar
+        time[:] = np.arange(n_time) * 10.0
+        reflectivity = nc.createVariable('Reflectivity', 'f4', ('time', 'heights'), fill_value=-999.0)
+        reflectivity[:] = rng.normal(size=(n_time, n_heights))
+
+
+def _compare_lazy_eager(dir_target):
+    ds_lazy = load_xarray_from_mmcrmom(str(dir_target), lazy=True)
+    ds_eager = load_xarray_from_mmcrmom(str(dir_target), lazy=False)
+    xr.testing.assert_identical(ds_lazy, ds_eager)
+
+
+def test_lazy_eager_agree_without_calendar(tmp_path):
+    for hour in range(3):
+        _write_mmcrmom(tmp_path / f'20210210{hour:02}0000MMCRMom.nc', hour)
+    _compare_lazy_eager(tmp_path)
+
+
+def test_lazy_eager_agree_with_calendar(tmp_path):
+    for hour in range(3):
+        _write_mmcrmom(tmp_path / f'20210210{hour:02}0000MMCRMom.nc', hour, calendar='standard')
+    _compare_lazy_eager(tmp_path)
@@ -0,0 +1,38 @@
+'''Author: Andrew Martin
+Creation date: 14/10/26
+
+Tests for concatenating the variables of several mpl files in load_mpl_inline.
+'''
+
+import numpy as np
+import pytest
+
+from eeasm_icesat.mpl.load_mpl_inline import _concat_data_vars
+
+
+def _data_vars(n_profile=3, n_range=5):
+    '''Function to create a small (dims, array, attrs) dictionary, as output by _mpl_dict_to_data_vars.'''
+    return {
+        'channel_1': (('profile', 'range'), np.ones((n_profile, n_range), dtype=np.float32), {}),
+        'shots_sum': (('profile',), np.arange(n_profile), {}),
+        'bin_time': ((), np.float64(2e-7), {}),
+    }
+
+
+def test_concat_data_vars():
+    data_vars = _concat_data_vars([_data_vars(3), _data_vars(2)])
+    assert data_vars['channel_1'][1].shape == (5, 5)
+    np.testing.assert_array_equal(data_vars['shots_sum'][1], [0, 1, 2, 0, 1])
+    assert data_vars['bin_time'][0] == ('profile',)
+
+
+def test_concat_data_vars_mismatched_range():
+    with pytest.raises(ValueError, match='b.mpl.gz'):
+        _concat_data_vars([_data_vars(3), _data_vars(3, n_range=6)], ['a.mpl.gz', 'b.mpl.gz'])
+
+
+def test_concat_data_vars_missing_variable():
+    dv = _data_vars()
+    del dv['shots_sum']
+    with pytest.raises(ValueError, match='c.mpl.gz'):
+        _concat_data_vars([_data_vars(), _data_vars(), dv], ['a.mpl.gz', 'b.mpl.gz', 'c.mpl.gz'])
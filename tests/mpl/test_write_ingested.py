@@ -0,0 +1,42 @@
+'''Author: Andrew Martin
+Creation date: 14/10/26
+
+Tests that write_ingested round-trips a small ingested-like dataset through the netcdf and zarr backends.
+'''
+
+import numpy as np
+import xarray as xr
+import pytest
+
+from eeasm_icesat.mpl.raw_to_ingested import write_ingested
+
+
+def _synthetic_ingested(n_time=240, n_height=50):
+    '''Function to create a small dataset with the dimensions and dtypes of the ingested format.'''
+    rng = np.random.default_rng(0)
+    times = np.datetime64('2021-02-10') + np.arange(n_time)*np.timedelta64(5, 's')
+    heights = np.arange(n_height, dtype=np.float64)*15 + 3000
+    data_vars = {
+        'backscatter_1': (('time', 'height'), rng.random((n_time, n_height), dtype=np.float32)),
+        'nshots': (('time',), rng.integers(0, 5000, n_time, dtype=np.int32)),
+        'lat': ((), np.float32(72.59622)),
+    }
+    return xr.Dataset(data_vars, coords={'time': times, 'height': heights})
+
+
+def test_write_ingested_netcdf(tmp_path):
+    ds = _synthetic_ingested()
+    fname = tmp_path / 'ingested.nc'
+    write_ingested(ds, fname, compression='zlib')
+    with xr.open_dataset(fname) as ds_out:
+        xr.testing.assert_identical(ds, ds_out.load())
+
+
+def test_write_ingested_zarr(tmp_path):
+    pytest.importorskip('zarr')
+    ds = _synthetic_ingested()
+    fname = tmp_path / 'ingested.zarr'
+    write_ingested(ds, fname, backend='zarr', chunks={'time': 120, 'height': 25})
+    with xr.open_zarr(fname) as ds_out:
+        assert ds_out['backscatter_1'].encoding['chunks'] == (120, 25)
+        xr.testing.assert_identical(ds, ds_out.load())